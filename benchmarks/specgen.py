@@ -0,0 +1,112 @@
+# benchmarks/specgen.py
+"""
+Synthetische Lastenhefte im Upload-Format von services/loader.load_table:
+Spalten ID, Label, danach je Modell eine Spalte.
+
+- Labels tragen eine Nummerierung ("3.1.2 requirement 17"), Tiefe und Fan-out sind begrenzt
+- unnummerierte Zeilen (Hinweise o.ä.) hängen wie im echten Sheet an der letzten Nummer
+- Modellzellen: leer (sparsity), sonst "x"/kurzer Text oder Zahl (numeric)
+Gleiche SpecConfig (inkl. seed) -> identische Tabelle.
+
+    python -m benchmarks.specgen out.csv --rows 20000 --models 10 --depth 5 --fanout 6
+"""
+import argparse
+import io
+from dataclasses import dataclass, asdict
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class SpecConfig:
+    rows: int = 10000
+    models: int = 10
+    max_depth: int = 4          # max. Nummerierungstiefe (1 = nur "3", 3 = "3.1.2")
+    fanout: int = 8             # max. Kinder je Knoten unterhalb der obersten Ebene
+    sparsity: float = 0.7       # Anteil leerer Modellzellen
+    unnumbered: float = 0.05    # Anteil Zeilen ohne Nummer im Label
+    numeric: float = 0.2        # Anteil Zahlen unter den gefüllten Zellen (Rest: Text)
+    seed: int = 0
+
+
+_WORDS = ["requirement", "low beam", "high beam", "sensor", "housing", "voltage", "bracket",
+          "connector", "lens", "durability", "thermal", "signal", "cover", "applicable document"]
+_TEXT = ["x", "x", "x", "ja", "optional", "Serie", "Option A"]
+
+
+def generate_spec(cfg: SpecConfig) -> pd.DataFrame:
+    """ Erzeugt die Tabelle zu `cfg` (deterministisch über cfg.seed). """
+    rng = np.random.default_rng(cfg.seed)
+    ids, labels = [], []
+    counters: list[int] = []
+    last_num = None
+    n_notes = 0
+    words = rng.integers(0, len(_WORDS), size=cfg.rows)
+    notes = rng.random(cfg.rows) < cfg.unnumbered
+    moves = rng.random(cfg.rows)
+    for i in range(cfg.rows):
+        if notes[i] and last_num is not None:
+            n_notes += 1
+            ids.append(f"{last_num}.n{n_notes}")
+            labels.append(f"Hinweis {_WORDS[words[i]]} {i}")
+            continue
+        # nächste Nummer: tiefer, Geschwister oder hoch (Fan-out/Tiefe begrenzt)
+        depth = len(counters)
+        can_down = 0 < depth < cfg.max_depth
+        can_side = depth > 0 and (depth == 1 or counters[-1] < cfg.fanout)
+        r = moves[i]
+        if depth == 0 or (can_down and (r < 0.35 or not can_side)):
+            counters.append(1)
+        elif can_side and (r < 0.8 or depth == 1):
+            counters[-1] += 1
+        else:
+            # hoch, bis eine Ebene noch Platz hat (oberste Ebene ist unbegrenzt)
+            counters.pop()
+            while len(counters) > 1 and counters[-1] >= cfg.fanout:
+                counters.pop()
+            counters[-1] += 1
+        last_num = ".".join(map(str, counters))
+        ids.append(last_num)
+        labels.append(f"{last_num} {_WORDS[words[i]]} {i}")
+
+    data: dict = {"ID": ids, "Label": labels}
+    for m in range(cfg.models):
+        filled = rng.random(cfg.rows) >= cfg.sparsity
+        is_num = rng.random(cfg.rows) < cfg.numeric
+        text = np.array(_TEXT, dtype=object)[rng.integers(0, len(_TEXT), size=cfg.rows)]
+        nums = np.round(rng.random(cfg.rows) * 100, 1)
+        col = np.where(filled, np.where(is_num, nums.astype(object), text), None)
+        data[f"Model_{m}"] = col
+    return pd.DataFrame(data)
+
+
+def spec_bytes(df: pd.DataFrame, fmt: str = "csv") -> bytes:
+    """ Tabelle als Upload-Datei (csv oder xlsx, xlsx braucht openpyxl). """
+    buf = io.BytesIO()
+    if fmt == "csv":
+        df.to_csv(buf, index=False)
+    elif fmt == "xlsx":
+        df.to_excel(buf, index=False)
+    else:
+        raise ValueError(f"Unbekanntes Format '{fmt}' (csv/xlsx).")
+    return buf.getvalue()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Synthetisches Lastenheft erzeugen")
+    ap.add_argument("out", help="Zieldatei (.csv oder .xlsx)")
+    defaults = SpecConfig()
+    for name, val in asdict(defaults).items():
+        ap.add_argument("--" + name.replace("_", "-"), type=type(val), default=val)
+    ap.add_argument("--depth", dest="max_depth", type=int, default=defaults.max_depth)
+    args = ap.parse_args()
+    cfg = SpecConfig(**{k: getattr(args, k) for k in asdict(defaults)})
+    fmt = "xlsx" if args.out.lower().endswith(".xlsx") else "csv"
+    with open(args.out, "wb") as f:
+        f.write(spec_bytes(generate_spec(cfg), fmt))
+    print(f"{args.out}: {cfg}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+# benchmarks/suite.py
+"""
+Benchmark-Suite über synthetische Lastenhefte (benchmarks.specgen) in mehreren Größen.
+
+Stufen (direkt über services/*):
+  load       load_table (CSV-Bytes -> DataFrame + meta)
+  hierarchy  parse_hierarchy
+  rollup     build_rollup (Treemap-Roll-ups aller Modelle)
+  trees      build_pruned_tree je Modell
+  index      build_model_index je Modell (geteilter SegmentPool)
+  blob       make_blob je Modell (JSON + gzip/br)
+Endpunkte (in-process über FastAPI TestClient, mit STORE/JOBS aus main):
+  upload     POST /upload + Polling /jobs bis fertig (inkl. Prozess-Pool)
+  tree_cold  erstes GET /tree je Modell (lazy Baum + Blob)
+  tree_warm  GET /tree je Modell, danach If-None-Match -> 304
+  search     POST /search (Stripe- und Phrase-Queries)
+  suggest    GET /suggest
+  treemap    POST /treemap je Modell
+  compare    POST /compare über alle Modelle
+
+Je Messung: Median über --repeat Läufe, Durchsatz (Zeilen/s bzw. Requests/s) und
+Peak-Speicher (tracemalloc, eigener Lauf ohne Zeitmessung).
+
+Skalierung des Baumbaus (--scaling): Zeilen fest / Modelle variiert und Modelle fest / Zeilen variiert.
+  parse      parse_hierarchy (einmal je Upload)
+  trees      parse + build_pruned_tree je Modell
+  no-gc s    trees mit abgeschaltetem zyklischen GC (dessen Aufwand wächst mit dem lebenden Heap,
+             nicht mit dem Builder); us/row und ms/model beziehen sich darauf:
+  us/row     no-gc / Zeilen                -> bei festen Modellen konstant über die Zeilenzahl
+  ms/model   (no-gc - parse) / Modelle     -> bei festen Zeilen konstant über die Modellzahl
+Der Nummerierungs-Parse läuft einmal je Zeile; je Modell kommt nur das Anhängen der Spalte dazu.
+
+    python -m benchmarks.suite [--sizes small medium] [--repeat 3]
+    python -m benchmarks.suite --sizes --scaling       # nur die Skalierungsreihen
+    python -m benchmarks.suite --save-baseline          # Ergebnisse als Baseline ablegen
+    python -m benchmarks.suite --check [--tolerance 0.25]  # gegen Baseline, Exit-Code 1 bei Regression
+
+Baselines sind maschinenabhängig: Standarddatei benchmarks/baselines/<Rechnername>.json.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.specgen import SpecConfig, generate_spec, spec_bytes
+
+SIZES: Dict[str, SpecConfig] = {
+    "small": SpecConfig(rows=2_000, models=5),
+    "medium": SpecConfig(rows=20_000, models=10),
+    "large": SpecConfig(rows=100_000, models=20, max_depth=6),
+}
+
+# (Zeilen, Modelle): erst Zeilen fest, dann Modelle fest
+SCALING: List[Tuple[int, int]] = (
+    [(20_000, m) for m in (5, 10, 20, 40)]
+    + [(r, 10) for r in (5_000, 20_000, 80_000)]
+)
+
+_SEARCH_QUERIES = ["requirement", "low beam", "sensor housing", "applicable document", "hinweis", "zzz"]
+_SUGGEST_PREFIXES = ["l", "lo", "sens", "app", "hin"]
+
+
+def _median_time(fn: Callable[[], Any], repeat: int, setup: Callable[[], Any] | None = None) -> float:
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def _median_time_nogc(fn: Callable[[], Any], repeat: int) -> float:
+    gc.collect()
+    gc.disable()
+    try:
+        return _median_time(fn, repeat)
+    finally:
+        gc.enable()
+
+
+def _peak_mb(fn: Callable[[], Any]) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+# -------- Stufen --------
+def stage_runners(cfg: SpecConfig) -> List[Tuple[str, Callable[[], Any], int]]:
+    """ (Name, Lauf, Einheiten) je Stufe; Einheiten = Zeilen (Durchsatz = Zeilen/s). """
+    from services.loader import load_table
+    from services.tree import parse_hierarchy, build_pruned_tree, build_model_index
+    from services.search import SegmentPool
+    from services.builder import build_rollup
+    from services.payload import make_blob
+
+    data = spec_bytes(generate_spec(cfg))
+    frames, meta = load_table(data, "bench.csv")
+    df = frames["main"]
+    models = meta["model_cols"]
+    hier = parse_hierarchy(df)
+    trees = {m: build_pruned_tree(hier, df[m]) for m in models}
+
+    def index():
+        pool = SegmentPool()
+        for m in models:
+            build_model_index(trees[m], pool)
+
+    rows = cfg.rows
+    return [
+        ("load", lambda: load_table(data, "bench.csv"), rows),
+        ("hierarchy", lambda: parse_hierarchy(df), rows),
+        ("rollup", lambda: build_rollup(df, meta), rows),
+        ("trees", lambda: [build_pruned_tree(hier, df[m]) for m in models], rows),
+        ("index", index, rows),
+        ("blob", lambda: [make_blob(trees[m]) for m in models], rows),
+    ]
+
+
+def scaling_runners(rows: int, models: int) -> Tuple[Callable[[], Any], Callable[[], Any]]:
+    """ (parse, trees) für eine Tabelle mit `rows` Zeilen und `models` Modellspalten. """
+    from services.loader import load_table
+    from services.tree import parse_hierarchy, build_pruned_tree
+
+    frames, meta = load_table(spec_bytes(generate_spec(SpecConfig(rows=rows, models=models))), "bench.csv")
+    df = frames["main"]
+    cols = meta["model_cols"]
+
+    def trees():
+        hier = parse_hierarchy(df)
+        return [build_pruned_tree(hier, df[m]) for m in cols]
+
+    return (lambda: parse_hierarchy(df)), trees
+
+
+# -------- Endpunkte --------
+def endpoint_runners(cfg: SpecConfig, client, seed: int) -> List[Tuple[str, Callable[[], Any], Callable[[], Any] | None, int]]:
+    """ (Name, Lauf, Setup vor jedem Lauf, Requests je Lauf) je Endpunkt. """
+    counter = {"seed": seed}
+
+    def upload_bytes() -> bytes:
+        # jeder Lauf eine andere Tabelle, sonst greift die Upload-Deduplizierung
+        counter["seed"] += 1
+        return spec_bytes(generate_spec(SpecConfig(**{**cfg.__dict__, "seed": counter["seed"]})))
+
+    def upload(data: bytes) -> Dict[str, Any]:
+        job = client.post("/upload", files={"file": ("bench.csv", data, "text/csv")}).json()
+        while True:
+            st = client.get(f"/jobs/{job['job_id']}").json()
+            if st["status"] == "done":
+                return st
+            if st["status"] == "error":
+                raise RuntimeError(st["error"])
+            time.sleep(0.005)
+
+    pending: Dict[str, Any] = {}
+    ds = upload(upload_bytes())
+    ds_id, models = ds["dataset_id"], ds["models"]
+    state: Dict[str, Any] = {}
+
+    def fresh_dataset():
+        if "cold" in state:
+            client.delete(f"/dataset/{state['cold']}")
+        state["cold"] = upload(upload_bytes())["dataset_id"]
+
+    def tree_cold():
+        for m in models:
+            client.get("/tree", params={"dataset_id": state["cold"], "model": m})
+
+    def tree_warm():
+        for m in models:
+            r = client.get("/tree", params={"dataset_id": ds_id, "model": m})
+            client.get("/tree", params={"dataset_id": ds_id, "model": m},
+                       headers={"If-None-Match": r.headers["etag"]})
+
+    def search():
+        for q in _SEARCH_QUERIES:
+            client.post("/search", json={"dataset_id": ds_id, "query": q, "limit": 100})
+
+    def suggest():
+        for p in _SUGGEST_PREFIXES:
+            client.get("/suggest", params={"dataset_id": ds_id, "q": p})
+
+    def treemap():
+        for m in models:
+            client.post("/treemap", json={"dataset_id": ds_id, "model": m})
+
+    def compare():
+        client.post("/compare", json={"dataset_id": ds_id, "models": models})
+
+    def upload_run():
+        pending["ds"] = upload(pending.pop("data"))["dataset_id"]
+
+    def upload_setup():
+        if "ds" in pending:
+            client.delete(f"/dataset/{pending.pop('ds')}")
+        pending["data"] = upload_bytes()
+
+    # Warmlauf: Indizes/Roll-ups/Blobs des Haupt-Datasets bauen
+    for fn in (tree_warm, search, suggest, treemap, compare):
+        fn()
+    n = len(models)
+    return [
+        ("upload", upload_run, upload_setup, 1),
+        ("tree_cold", tree_cold, fresh_dataset, n),
+        ("tree_warm", tree_warm, None, 2 * n),
+        ("search", search, None, len(_SEARCH_QUERIES)),
+        ("suggest", suggest, None, len(_SUGGEST_PREFIXES)),
+        ("treemap", treemap, None, n),
+        ("compare", compare, None, 1),
+    ]
+
+
+# -------- Suite --------
+def run_suite(sizes: List[str], repeat: int, memory: bool, endpoints: bool) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    client = None
+    if endpoints and sizes:
+        from fastapi.testclient import TestClient
+        import main as app_main
+        client = TestClient(app_main.app)
+    for size in sizes:
+        cfg = SIZES[size]
+        for name, fn, units in stage_runners(cfg):
+            fn()  # Warmlauf
+            sec = _median_time(fn, repeat)
+            res = {"seconds": sec, "throughput": units / sec if sec else None, "unit": "rows/s"}
+            if memory:
+                res["peak_mb"] = _peak_mb(fn)
+            results[f"{size}/{name}"] = res
+            _print_row(f"{size}/{name}", res)
+        if client is not None:
+            for name, fn, setup, units in endpoint_runners(cfg, client, seed=1000):
+                sec = _median_time(fn, repeat, setup)
+                res = {"seconds": sec, "throughput": units / sec if sec else None, "unit": "req/s"}
+                if memory:
+                    if setup:
+                        setup()
+                    res["peak_mb"] = _peak_mb(fn)
+                results[f"{size}/{name}"] = res
+                _print_row(f"{size}/{name}", res)
+    if client is not None:
+        app_main.JOBS.shutdown()
+    return results
+
+
+def run_scaling(repeat: int) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    print(f"\n{'rows':>8} {'models':>7} {'parse s':>9} {'trees s':>9} {'no-gc s':>9} {'us/row':>8} {'ms/model':>9}")
+    for rows, models in SCALING:
+        parse, trees = scaling_runners(rows, models)
+        trees()  # Warmlauf
+        t_parse = _median_time(parse, repeat)
+        t_trees = _median_time(trees, repeat)
+        t_nogc = _median_time_nogc(trees, repeat)
+        per_model = max(t_nogc - t_parse, 0.0) / models
+        print(f"{rows:>8} {models:>7} {t_parse:>9.3f} {t_trees:>9.3f} {t_nogc:>9.3f} "
+              f"{t_nogc / rows * 1e6:>8.1f} {per_model * 1e3:>9.2f}", flush=True)
+        results[f"scaling/r{rows}_m{models}"] = {
+            "seconds": t_trees, "throughput": rows / t_trees if t_trees else None, "unit": "rows/s",
+            "parse_seconds": t_parse, "seconds_per_model": per_model, "seconds_no_gc": t_nogc,
+        }
+    return results
+
+
+def _print_row(key: str, res: Dict[str, Any]) -> None:
+    mem = f"{res['peak_mb']:>9.1f}" if "peak_mb" in res else f"{'-':>9}"
+    print(f"{key:<24} {res['seconds']:>10.4f} {res['throughput']:>14,.0f} {res['unit']:<7} {mem}", flush=True)
+
+
+# -------- Baselines --------
+def default_baseline_path() -> str:
+    return os.path.join(os.path.dirname(__file__), "baselines", f"{platform.node() or 'default'}.json")
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, Any]]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    old = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            old = json.load(f).get("results", {})
+    doc = {"python": platform.python_version(), "machine": platform.machine(), "results": {**old, **results}}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+
+
+def check_baseline(path: str, results: Dict[str, Dict[str, Any]], tolerance: float,
+                   min_delta: float = 0.005) -> List[str]:
+    """ Messungen, die mehr als `tolerance` (relativ) und `min_delta` Sekunden langsamer sind. """
+    with open(path, encoding="utf-8") as f:
+        base = json.load(f)["results"]
+    slower = []
+    for key, res in results.items():
+        ref = base.get(key)
+        if ref is None:
+            continue
+        delta = res["seconds"] - ref["seconds"]
+        if delta > min_delta and res["seconds"] > ref["seconds"] * (1 + tolerance):
+            slower.append(f"{key}: {ref['seconds']:.4f}s -> {res['seconds']:.4f}s (+{delta / ref['seconds']:.0%})")
+    return slower
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark-Suite (Stufen + Endpunkte)")
+    ap.add_argument("--sizes", nargs="*", choices=list(SIZES), default=["small", "medium"])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--no-memory", action="store_true", help="ohne tracemalloc-Peak (schneller)")
+    ap.add_argument("--no-endpoints", action="store_true", help="nur Stufen, ohne FastAPI-Endpunkte")
+    ap.add_argument("--baseline", default=default_baseline_path())
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--check", action="store_true", help="gegen Baseline prüfen (Exit-Code 1 bei Regression)")
+    ap.add_argument("--scaling", action="store_true", help="Baumbau: Zeilen bzw. Modelle getrennt variieren")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args()
+    no_baseline = f"keine Baseline unter {args.baseline}; zuerst mit --save-baseline anlegen"
+    if args.check and not args.save_baseline and not os.path.exists(args.baseline):
+        sys.exit(no_baseline)   # vor dem Lauf abbrechen statt nach Minuten Messung
+
+    if args.sizes:
+        print(f"{'measurement':<24} {'median s':>10} {'throughput':>14} {'':<7} {'peak MB':>9}")
+    results = run_suite(args.sizes, args.repeat, memory=not args.no_memory, endpoints=not args.no_endpoints)
+    if args.scaling:
+        results.update(run_scaling(args.repeat))
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Baseline gespeichert: {args.baseline}")
+    if args.check:
+        try:
+            slower = check_baseline(args.baseline, results, args.tolerance)
+        except FileNotFoundError:
+            sys.exit(no_baseline)
+        for line in slower:
+            print("REGRESSION", line)
+        if slower:
+            sys.exit(1)
+        print("keine Regression gegenüber", args.baseline)
+
+
+if __name__ == "__main__":
+    main()
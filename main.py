@@ -1,21 +1,50 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Query
+from fastapi.responses import HTMLResponse, Response, JSONResponse, StreamingResponse
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 import traceback
+import time
+import os
+import atexit
+import json
 
 # Services
-from services.loader import load_table
-from services.store import STORE
-from services.builder import list_models, build_treemap_for_model  # treemap optional
+from services.upload import spool_upload, too_large, limit_message, UploadTooLarge
+from services.payload import JsonBlob, etag_matches
+from services import metrics
+from models.schemas import CompareRequest, CoverageMissingRequest, DatasetPatch, BatchSearchRequest
+from services.store import STORE, PatchConflict
+from services.builder import build_treemap_for_model  # treemap optional
+from services.jobs import make_jobs, JobQueueFull
 from services.tree import (
-    build_all_model_trees,  # baut pro Modell den geprunten Baum + Suchindex
     to_words,
-    stripe_matches_for_model,
-    phrase_matches_for_model,
+    normalize,
+    slice_tree,
+    lod_tree,
 )
+from services.search import search_models, search_batch
+from services.coverage import node_coverage, missing_nodes, rank_models
+from services.export import check_format, export_batches, tree_batches, export_stream
+
+# Upload-Dedup zusätzlich über den Hash des normalisierten DataFrames (Rohbytes immer)
+DEDUP_FRAME = os.environ.get("TABLES_DEDUP_FRAME", "1") not in ("0", "false", "no")
+
+# Ingestion (Parsen + Bäume + Index) läuft als Job im Prozess-Pool
+JOBS = make_jobs(STORE, dedup_frame=DEDUP_FRAME)
+atexit.register(JOBS.shutdown)
+atexit.register(STORE.flush)  # lazy gebaute Bäume/Indizes für den nächsten Start sichern
+
+# /search/batch: Threads je Query über TABLES_SEARCH_WORKERS, max. Queries je Request über TABLES_SEARCH_BATCH_MAX
+SEARCH_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("TABLES_SEARCH_WORKERS") or min(4, os.cpu_count() or 1)),
+    thread_name_prefix="search",
+)
+SEARCH_BATCH_MAX = int(os.environ.get("TABLES_SEARCH_BATCH_MAX") or 1000)
+atexit.register(SEARCH_POOL.shutdown, wait=False, cancel_futures=True)
 
 app = FastAPI(title="Treemap API (ID/Label + Modelle als Spalten)")
 
@@ -29,16 +58,41 @@ app.add_middleware(
 # Statische Dateien (HTML/JS/CSS)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+if metrics.ENABLED:
+    @app.middleware("http")
+    async def server_timing(request: Request, call_next):
+        """ Stufen des Requests als Server-Timing-Header + Latenz je Route für /metrics. """
+        token = metrics.start_request()
+        t0 = time.perf_counter()
+        response = await call_next(request)
+        total = time.perf_counter() - t0
+        header = metrics.end_request(token, total)
+        if header:
+            response.headers["Server-Timing"] = header
+            response.headers["Timing-Allow-Origin"] = "*"
+        route = request.scope.get("route")
+        metrics.observe_request(getattr(route, "path", "unmatched"), request.method, total)
+        return response
+
+@app.middleware("http")
+async def upload_limit(request: Request, call_next):
+    """ Zu große Uploads schon am Content-Length ablehnen, bevor der Body gelesen wird. """
+    if request.url.path == "/upload" and too_large(request.headers.get("content-length")):
+        return JSONResponse(status_code=413, content={"detail": limit_message()})
+    return await call_next(request)
+
 
 # ---------- Schemas ----------
 class UploadOut(BaseModel):
-    dataset_id: str
-    models: List[str]
+    job_id: str
+    status: str
+    dataset_id: Optional[str] = None
 
 class TreemapIn(BaseModel):
     dataset_id: str
     model: str
     path_parts: Optional[List[str]] = None
+    max_nodes: Optional[int] = Field(None, ge=1)   # Level-of-Detail: kleinste Geschwister -> "other (n items)"
 
 class SearchIn(BaseModel):
     dataset_id: str
@@ -48,32 +102,26 @@ class SearchIn(BaseModel):
 
 
 # ---------- Helpers ----------
-def _collapse_to_ancestors_only(hits: List[dict]) -> List[dict]:
-    """
-    Entfernt 'tiefere' Treffer, wenn bereits ein Vorfahr desselben Modells enthalten ist.
-    Beispiel: Behalte
-      Root > 3 ... > 3.3 Applicable document
-    und entferne
-      Root > 3 ... > 3.3 Applicable document > hella ... > low beam ...
-    """
-    # sortiere nach Pfadlänge (kürzeste zuerst)
-    hits_sorted = sorted(hits, key=lambda x: (x["model"], len(x.get("anchor_parts", []))))
-    kept: List[dict] = []
-    for h in hits_sorted:
-        parts = h.get("anchor_parts", [])
-        is_descendant = False
-        for k in kept:
-            if k["model"] != h["model"]:
-                continue
-            kp = k.get("anchor_parts", [])
-            if len(parts) >= len(kp) and parts[:len(kp)] == kp:
-                is_descendant = True
-                break
-        if not is_descendant:
-            kept.append(h)
-    # schöne Sortierung
-    kept = sorted(kept, key=lambda x: (x["model"], x["path_label"]))
-    return kept
+def _search_model_order(models: List[str], model: Optional[str]) -> List[str]:
+    """ Modelle für /search in Ergebnisreihenfolge; unbekannter Modellfilter -> keine. """
+    if model:
+        return [model] if model in models else []
+    return sorted(models)
+
+
+def _blob_response(blob: JsonBlob, request: Request) -> Response:
+    """ Liefert vorab komprimiertes JSON; passender If-None-Match -> 304 ohne Body. """
+    headers = {"ETag": blob.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), blob.etag):
+        return Response(status_code=304, headers=headers)
+    accept = request.headers.get("accept-encoding", "").lower()
+    if blob.br is not None and "br" in accept:
+        body, headers["Content-Encoding"] = blob.br, "br"
+    elif "gzip" in accept:
+        body, headers["Content-Encoding"] = blob.gzip, "gzip"
+    else:
+        body = blob.raw()
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 # ---------- Routes ----------
@@ -89,37 +137,82 @@ def home():
 @app.post("/upload")
 async def upload(file: UploadFile = File(...)) -> UploadOut:
     """
-    - Liest CSV/XLSX
-    - Baut pro Modell den geprunten Baum & Suchindex (Stripe)
-    - Speichert alles In-Memory
-    - Gibt dataset_id + Modellnamen zurück
+    - Nimmt CSV/XLSX an und startet die Ingestion als Hintergrund-Job
+    - Parsen + Hierarchie laufen im Prozess-Pool; Bäume & Suchindex je Modell
+      entstehen lazy beim ersten /tree bzw. /search (kleine Dateien optional sofort)
+    - Identischer Inhalt -> Job ist sofort fertig (bestehendes Bundle)
+    - Gibt job_id zurück; Fortschritt + dataset_id über GET /jobs/{job_id}
+    - Datei wird blockweise in den Upload-Ordner kopiert (nie komplett im Speicher),
+      über TABLES_UPLOAD_MAX_MB -> 413
     """
     try:
-        data = await file.read()
-        frames, meta = load_table(data, file.filename)
-        # Bäume + Index auf Basis des Upload-DFs bauen (PRUNING inklusive)
-        trees, index = build_all_model_trees(frames["main"])
-        ds_id = STORE.create(frames=frames, meta=meta, trees=trees, index=index)
-        models = list_models(frames["main"])
-        return UploadOut(dataset_id=ds_id, models=models)
-    except Exception as e:
-        traceback.print_exc()
-        raise HTTPException(status_code=400, detail=f"Upload/Parsing-Fehler: {type(e).__name__}: {e}")
+        path, digest = await spool_upload(file, file.filename)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        # Dedup-Treffer können ein ausgelagertes Bundle von der Platte laden -> nicht im Event-Loop
+        job_id = await run_in_threadpool(JOBS.submit, path, file.filename, digest)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    job = JOBS.get(job_id)
+    return UploadOut(job_id=job_id, status=job["status"], dataset_id=job["dataset_id"])
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """
+    Status eines Upload-Jobs:
+      { "status": "queued|running|done|error", "stage": "parse|build|index",
+        "stages": {"build": {"done": 3, "total": 40, "model": "..."}, ...},
+        "dataset_id": ..., "models": [...], "error": ... }
+    """
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, "job_id not found")
+    return job
 
 
 @app.get("/tree")
-def tree(dataset_id: str, model: str):
+def tree(
+    dataset_id: str,
+    model: str,
+    request: Request,
+    anchor: Optional[List[str]] = Query(None),
+    max_depth: Optional[int] = Query(None, ge=0),
+    max_nodes: Optional[int] = Query(None, ge=1),
+    lod: bool = False,
+):
     """
     Gibt den **geprunten** Baum eines Modells zurück (als JSON-Objekt).
     Frontend zeichnet daraus die Treemap.
+    Ganzer Baum (ohne anchor/max_depth, max_nodes nicht überschritten): einmal serialisiert
+    + komprimiert (gzip/br) mit ETag; Wiederholungen mit If-None-Match bekommen 304.
+    Optional nur ein Ausschnitt:
+      - anchor (mehrfach): anchor_parts eines /search-Treffers -> nur dieser Teilbaum
+      - max_depth: Ebenen unterhalb des Ankers
+      - max_nodes: max. Knoten (breitenweise); gekappte Knoten tragen "more"
+      - lod: mit max_nodes statt breitenweise die kleinsten Geschwister zu "other (n items)" zusammenfassen;
+        Sammelknoten und zugeklappte Knoten tragen "size" (Blattanzahl)
     """
     if not STORE.has(dataset_id):
         raise HTTPException(404, "dataset_id not found")
     bundle = STORE.get(dataset_id)
-    t = bundle.trees.get(model)
-    if not t:
+    n_nodes = bundle.tree_node_count(model)
+    if n_nodes is None:
         raise HTTPException(404, f"Model '{model}' not found")
-    return t
+    if not anchor and max_depth is None and (max_nodes is None or n_nodes <= max_nodes):
+        return _blob_response(bundle.tree_blob(model), request)
+
+    node = bundle.tree(model)
+    if anchor:
+        node = bundle.tree_node(model, anchor)
+        if node is None:
+            raise HTTPException(404, "anchor not found")
+    if lod and max_nodes is not None:
+        if max_depth is not None:
+            node = slice_tree(node, max_depth=max_depth)
+        return lod_tree(node, max_nodes)
+    return slice_tree(node, max_depth=max_depth, max_nodes=max_nodes)
 
 
 @app.post("/search")
@@ -133,44 +226,173 @@ def search(req: SearchIn):
     """
     if not STORE.has(req.dataset_id):
         raise HTTPException(404, "dataset_id not found")
-    idx = STORE.get(req.dataset_id).index
-    if not idx:
+    bundle = STORE.get(req.dataset_id)
+    return search_models(_search_model_order(bundle.models(), req.model),
+                         lambda m: bundle.model_index(m)["nodes"], to_words(req.query or ""), max(1, req.limit))
+
+
+@app.post("/search/batch")
+def search_batch_route(req: BatchSearchRequest):
+    """
+    Viele Queries gegen ein Dataset in einem Request (gleiche Regeln wie /search je Query).
+    Queries laufen parallel im Such-Pool; Antwort als NDJSON, eine Zeile je Query, sobald sie fertig ist
+    (Reihenfolge = Fertigstellung, "index" = Position in req.queries):
+      {"index": 3, "query": "...", "results": [ {model, path_label, anchor_parts}, ... ]}
+    """
+    if not STORE.has(req.dataset_id):
+        raise HTTPException(404, "dataset_id not found")
+    if len(req.queries) > SEARCH_BATCH_MAX:
+        raise HTTPException(400, f"Zu viele Queries (max {SEARCH_BATCH_MAX}).")
+    bundle = STORE.get(req.dataset_id)
+    models = _search_model_order(bundle.models(), req.model)
+    queries = [to_words(q or "") for q in req.queries]
+
+    def lines():
+        for i, hits in search_batch(SEARCH_POOL, models, lambda m: bundle.model_index(m)["nodes"],
+                                    queries, max(1, req.limit)):
+            yield json.dumps({"index": i, "query": req.queries[i], "results": hits}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/export")
+def export(dataset_id: str, request: Request, table: str = "rollup", format: str = "ndjson"):
+    """
+    Bulk-Export für Analysejobs (Spalten: services/export.py), blockweise erzeugt und gestreamt:
+      - table=rollup: eine Zeile je (Knoten, Modell) mit Hierarchie, Zellwert, present/covered und Roll-ups
+      - table=tree: die geprunten Modellbäume als Knotentabelle (Pre-Order)
+    format: ndjson (gzip-komprimiert, falls Accept-Encoding gzip).
+    """
+    if not STORE.has(dataset_id):
+        raise HTTPException(404, "dataset_id not found")
+    try:
+        check_format(table, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Export-Fehler: {e}")
+    bundle = STORE.get(dataset_id)
+    if table == "rollup":
+        batches = export_batches(bundle.frames["main"], bundle.get_rollup())
+    else:
+        batches = tree_batches(bundle.models(), bundle.tree)
+    gzip = "gzip" in request.headers.get("accept-encoding", "").lower()
+    headers = {"Content-Disposition": f'attachment; filename="{dataset_id}_{table}.ndjson"', "Vary": "Accept-Encoding"}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(export_stream(batches, gzip=gzip), media_type="application/x-ndjson", headers=headers)
+
+
+@app.delete("/dataset/{dataset_id}")
+def delete_dataset(dataset_id: str):
+    """ Gibt eine dataset_id frei (geteilte Bundles bleiben für andere IDs erhalten). """
+    if not STORE.has(dataset_id):
+        raise HTTPException(404, "dataset_id not found")
+    STORE.release(dataset_id)
+    return {"deleted": dataset_id}
+
+
+@app.patch("/dataset/{dataset_id}")
+def patch_dataset(dataset_id: str, req: DatasetPatch):
+    """
+    Ändert ein Dataset ohne Neu-Upload; die dataset_id bleibt gültig.
+    - columns: {Modell: {ID: Wert}} -> Modellspalte anlegen oder ersetzen
+    - rows: [{"ID": ..., "Label": ..., <Modell>: Wert}] -> Zeilen per ID ändern, neue IDs anhängen
+    Nur betroffene Modelle bauen Baum/Suchindex neu (lazy beim nächsten Zugriff).
+    """
+    if not STORE.has(dataset_id):
+        raise HTTPException(404, "dataset_id not found")
+    if not req.columns and not req.rows:
+        raise HTTPException(400, "Keine Änderungen (columns/rows leer).")
+    try:
+        res = STORE.patch(dataset_id, columns=req.columns, rows=req.rows)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Patch-Fehler: {e}")
+    except PatchConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"dataset_id": dataset_id, **res}
+
+
+@app.get("/store/stats")
+def store_stats():
+    """ Cache-Statistik des Dataset-Speichers (Hits/Misses/Evictions/resident Bytes). """
+    return STORE.stats()
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """ Latenz-Histogramme je Stufe/Route + Zähler im Prometheus-Textformat (TABLES_METRICS=0 -> leer). """
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/suggest")
+def suggest(dataset_id: str, q: str, k: int = Query(10, ge=1, le=100), model: Optional[str] = None):
+    """
+    Typeahead: Top-k Knotennamen, deren normalisiertes Segment (oder ein Wort darin)
+    mit q beginnt. Rückgabe: [{ "model", "name", "anchor_parts", "path_label" }, ...]
+    """
+    if not STORE.has(dataset_id):
+        raise HTTPException(404, "dataset_id not found")
+    prefix = normalize(q)
+    if not prefix:
         return []
+    return STORE.get(dataset_id).suggest(prefix, k, model or None)
+
+
+@app.post("/compare")
+def compare(req: CompareRequest):
+    """
+    N-Wege-Vergleich beliebig vieler Modelle (optional nur ein Abschnitt):
+    pro Knoten Werte, Präsenz, Abdeckung und Delta zur Baseline (Default: erstes Modell).
+    Ergebnis wird je (Dataset, Modellmenge, Baseline, Abschnitt) gecacht.
+    """
+    if not STORE.has(req.dataset_id):
+        raise HTTPException(404, "dataset_id not found")
+    bundle = STORE.get(req.dataset_id)
+    try:
+        return bundle.compare(req.models, req.baseline, req.section)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Vergleich-Fehler: {e}")
 
-    q_words = to_words(req.query or "")
-    phrase = " ".join(q_words)
-
-    # Modellfilter vorbereiten
-    def iter_models():
-        if req.model and req.model in idx:
-            yield req.model, idx[req.model]
-        elif req.model:
-            # unbekanntes Modell -> keine Treffer
-            return
-        else:
-            for m, data in idx.items():
-                yield m, data
-
-    results: List[dict] = []
-
-    # 1) Stripe (PATH)
-    if len(q_words) >= 2:
-        for m, data in iter_models():
-            sm = stripe_matches_for_model(data["paths"], data["npaths"], q_words)
-            for h in sm:
-                results.append({"model": m, **h})
-        if results:
-            results = _collapse_to_ancestors_only(results)
-            return results[: max(1, req.limit)]
-
-    # 2) Fallback: exakte Phrase (TERM)
-    for m, data in iter_models():
-        pm = phrase_matches_for_model(data["paths"], data["npaths"], phrase)
-        for h in pm:
-            results.append({"model": m, **h})
-
-    results = _collapse_to_ancestors_only(results)
-    return results[: max(1, req.limit)]
+
+@app.get("/coverage")
+def coverage(dataset_id: str, node: str = ""):
+    """
+    Welche Modelle füllen einen Knoten (ID) und seine Kinder: je Knoten `present` (eigene Zelle)
+    und `covered` (inkl. Nachfahren). Ohne node: die Top-Level-Knoten.
+    """
+    if not STORE.has(dataset_id):
+        raise HTTPException(404, "dataset_id not found")
+    bundle = STORE.get(dataset_id)
+    try:
+        return node_coverage(bundle.get_rollup(), bundle.get_coverage(), node or None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Abdeckung-Fehler: {e}")
+
+
+@app.post("/coverage/missing")
+def coverage_missing(req: CoverageMissingRequest):
+    """
+    Knoten (optional nur im Teilbaum von node), denen mindestens eines der gewählten Modelle fehlt,
+    je Knoten mit den fehlenden Modellen; `total` zählt alle, `nodes` max. limit.
+    """
+    if not STORE.has(req.dataset_id):
+        raise HTTPException(404, "dataset_id not found")
+    bundle = STORE.get(req.dataset_id)
+    try:
+        return missing_nodes(bundle.get_rollup(), bundle.get_coverage(), req.models, req.node, req.mode, req.limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Abdeckung-Fehler: {e}")
+
+
+@app.get("/coverage/rank")
+def coverage_rank(dataset_id: str, node: str = "", mode: str = "covered"):
+    """ Modelle nach Anzahl abgedeckter Knoten (optional nur im Teilbaum von node), absteigend. """
+    if not STORE.has(dataset_id):
+        raise HTTPException(404, "dataset_id not found")
+    bundle = STORE.get(dataset_id)
+    try:
+        return rank_models(bundle.get_rollup(), bundle.get_coverage(), node or None, mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Abdeckung-Fehler: {e}")
 
 
 # (Optional) Falls irgendwo noch /treemap genutzt wird:
@@ -178,14 +400,16 @@ def search(req: SearchIn):
 def treemap(req: TreemapIn):
     """
     Liefert Plotly-kompatible Arrays (labels, parents, values, ids).
-    Nutzt weiterhin DF + Meta; unabhängig von /tree.
+    Nutzt DF + Meta + vorberechnete Roll-ups; unabhängig von /tree.
+    max_nodes: höchstens so viele Knoten, kleinste Geschwister als "other (n items)" mit ihrer Summe.
     """
     if not STORE.has(req.dataset_id):
         raise HTTPException(404, "dataset_id not found")
     bundle = STORE.get(req.dataset_id)
     df = bundle.frames["main"]
     try:
-        arr = build_treemap_for_model(df, bundle.meta, req.model, req.path_parts)
+        arr = build_treemap_for_model(df, bundle.meta, req.model, req.path_parts, rollup=bundle.get_rollup(),
+                                      max_nodes=req.max_nodes)
         return arr
     except Exception as e:
         traceback.print_exc()
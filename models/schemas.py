@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 class UploadResponse(BaseModel):
     dataset_id: str
@@ -22,6 +22,12 @@ class SearchRequest(BaseModel):
     limit: int = 20
     model: Optional[str] = None  # optionaler Modellfilter
 
+class BatchSearchRequest(BaseModel):
+    dataset_id: str
+    queries: List[str]
+    limit: int = 100
+    model: Optional[str] = None  # optionaler Modellfilter (für alle Queries)
+
 class SearchHit(BaseModel):
     model: str
     path: str
@@ -29,6 +35,19 @@ class SearchHit(BaseModel):
 
 class CompareRequest(BaseModel):
     dataset_id: str
-    model_a: str
-    model_b: str
-    section: str | None = None
+    models: List[str]
+    baseline: str | None = None   # Default: erstes Modell
+    section: str | None = None    # Label eines Top-Level-Abschnitts
+
+class CoverageMissingRequest(BaseModel):
+    dataset_id: str
+    models: List[str]
+    node: str | None = None       # ID; nur dessen Teilbaum
+    mode: str = "covered"         # covered (inkl. Nachfahren) | present (eigene Zelle)
+    limit: int = 1000
+
+class DatasetPatch(BaseModel):
+    # columns: {Modell: {ID: Wert}} -> Modellspalte anlegen/ersetzen
+    # rows: [{"ID": ..., "Label": ..., <Modell>: Wert}] -> Zeilen per ID aktualisieren oder anhängen
+    columns: Dict[str, Dict[str, Any]] = {}
+    rows: List[Dict[str, Any]] = []
@@ -1,8 +1,13 @@
 # services/builder.py
 from typing import List, Dict, Any
+from dataclasses import dataclass, replace
 import math
+import numpy as np
 import pandas as pd
 
+from .tree import truthy_mask, select_lod_nodes, lod_label
+from .metrics import timed
+
 def list_models(df: pd.DataFrame) -> list[str]:
     return [c for c in df.columns if c not in ("ID", "Label")]
 
@@ -19,115 +24,254 @@ def _collect_subtree_ids(root_id: str, children_map: dict) -> list[str]:
 def _find_root_ids(parent_map: dict) -> list[str]:
     return [i for i, p in parent_map.items() if p == ""]
 
+# -------- Roll-up-Engine (einmal pro Dataset, alle Modelle vektorisiert) --------
+@dataclass
+class Rollup:
+    """
+    Integer-indizierte ID-Hierarchie + vorberechnete Roll-ups für ALLE Modellspalten.
+    Knoten 0..n-1 = eindeutige IDs in Reihenfolge des ersten Auftretens.
+    """
+    ids: List[str]                    # ID je Knoten
+    labels: np.ndarray                # Label je Knoten (label_map, object)
+    parent: np.ndarray                # Elternknoten, -1 = Top-Level/verwaist
+    parent_ids: np.ndarray            # Eltern-ID je Knoten, None wenn Eltern nicht existieren (object)
+    row_node: np.ndarray              # Knoten je DF-Zeile (Scope ohne Anker)
+    order: np.ndarray                 # Traversierung wie _collect_subtree_ids, Teilbäume zusammenhängend
+    pos: np.ndarray                   # Position je Knoten in `order` (-1 = nicht erreichbar)
+    size: np.ndarray                  # Teilbaumgröße je Knoten
+    path_index: Dict[tuple, int]      # Label-Pfad -> Knoten (erster Treffer wie DFS über Labels)
+    col: Dict[str, int]               # Modell -> Spalte in base/totals
+    totals: np.ndarray                # (Knoten x Modelle) Roll-up: Summe der Kinder, sonst Basiswert
+    counts: np.ndarray                # Fallback-Roll-up: Anzahl Blätter je Knoten
+    present: np.ndarray               # (Knoten x Modelle) bool: Zelle hat einen Wert (_is_truthy)
+    covered: np.ndarray               # (Knoten x Modelle) bool: Knoten oder ein Nachfahre hat einen Wert
+    root_totals: np.ndarray           # Root-Wert ohne Anker je Modell
+    root_count: float                 # Root-Wert des Fallbacks ohne Anker
+    has_top: bool                     # gibt es überhaupt Top-Level-Zeilen
+
+def _base_value(val) -> float:
+    # numeric -> float; NaN -> 0; strings: non-empty -> 1 (Präsenz), sonst 0
+    try:
+        v = float(val)
+        if math.isnan(v):
+            return 0.0
+        return v
+    except Exception:
+        if val is None:
+            return 0.0
+        txt = str(val).strip()
+        if txt == "" or txt.lower() == "nan":
+            return 0.0
+        return 1.0
+
+def _base_column(col: pd.Series) -> np.ndarray:
+    """ _base_value für eine ganze Spalte (einmal je distinktem Wert). """
+    if isinstance(col.dtype, np.dtype) and col.dtype.kind in "fiub":
+        return np.nan_to_num(col.to_numpy(dtype=float), nan=0.0, posinf=np.inf, neginf=-np.inf)
+    codes, uniques = pd.factorize(col)
+    vals = np.fromiter((_base_value(v) for v in uniques), dtype=float, count=len(uniques))
+    return np.append(vals, 0.0)[codes]
+
+def _seq_sum(mat: np.ndarray) -> np.ndarray:
+    # sequentielle Summe (wie Python sum) statt paarweiser Summation -> identische Rundung
+    return np.cumsum(mat, axis=0)[-1] if len(mat) else np.zeros(mat.shape[1:])
+
+def _rollup_values(df: pd.DataFrame, models: List[str], row_node: np.ndarray, parent: np.ndarray,
+                   depth: np.ndarray, has_kids: np.ndarray):
+    """ totals/counts/present/covered für die Spalten `models` (Spalten unabhängig voneinander). """
+    n = len(parent)
+    # Basiswerte (Knoten x Modelle); doppelte IDs zählen als Präsenz (1.0) wie s.get(i) -> Series
+    dup = np.bincount(row_node, minlength=n) > 1
+    base = np.zeros((n, len(models)), dtype=float)
+    present = np.zeros((n, len(models)), dtype=bool)
+    for j, m in enumerate(models):
+        base[row_node, j] = _base_column(df[m])
+        np.logical_or.at(present[:, j], row_node, truthy_mask(df[m]))
+    base[dup] = 1.0
+
+    # Bottom-up je Tiefe: Eltern = Summe der Kinder (falls != 0), sonst Basiswert
+    totals = base.copy()
+    counts = np.ones(n, dtype=float)
+    covered = present.copy()
+    ssum = np.zeros_like(base)
+    csum = np.zeros(n, dtype=float)
+    for d in sorted(set(depth.tolist()), reverse=True):
+        lvl = np.flatnonzero(depth == d)         # Knotenreihenfolge = Kinderreihenfolge
+        inner = lvl[has_kids[lvl]]
+        if len(inner):
+            s = ssum[inner]
+            totals[inner] = np.where(s == 0.0, base[inner], s)
+            counts[inner] = csum[inner]
+        up = lvl[parent[lvl] >= 0]
+        if len(up):
+            np.add.at(ssum, parent[up], totals[up])
+            np.add.at(csum, parent[up], counts[up])
+            np.logical_or.at(covered, parent[up], covered[up])
+
+    return totals, counts, present, covered
+
+@timed("builder.rollup")
+def build_rollup(df: pd.DataFrame, meta: dict) -> Rollup:
+    parent_map: dict = meta["parent_map"]
+    label_map: dict = meta["label_map"]
+    children_map: dict = meta["children_map"]
+    models = list_models(df)
+
+    ids = list(parent_map)                       # eindeutig, erstes Auftreten
+    n = len(ids)
+    pos_of = {i: k for k, i in enumerate(ids)}
+    parent = np.array([pos_of.get(parent_map[i], -1) if parent_map[i] != i else -1 for i in ids], dtype=np.int64)
+    parent_ids = np.array([parent_map[i] if parent_map[i] in pos_of else None for i in ids], dtype=object)
+    labels = np.array([label_map.get(i, i) for i in ids], dtype=object)
+    depth = np.array([1 + i.count(".") for i in ids], dtype=np.int64)
+    row_ids = df["ID"].astype(str).to_numpy(dtype=object)
+    row_node = np.fromiter((pos_of[i] for i in row_ids), dtype=np.int64, count=len(row_ids))
+
+    children = [[pos_of[c] for c in children_map.get(i, []) if c != i] for i in ids]
+    tops = [pos_of[c] for c in children_map.get("", []) if c in pos_of and c != ""]
+
+    # Traversierung wie _collect_subtree_ids (Stack, letztes Kind zuerst) ab virtueller Wurzel
+    order_l: List[int] = []
+    stack = list(tops)
+    while stack:
+        v = stack.pop()
+        order_l.append(v)
+        stack.extend(children[v])
+    order = np.array(order_l, dtype=np.int64)
+    pos = np.full(n, -1, dtype=np.int64)
+    pos[order] = np.arange(len(order))
+    size = np.ones(n, dtype=np.int64)
+    for v in reversed(order_l):
+        if parent[v] >= 0:
+            size[parent[v]] += size[v]
+
+    # Label-Pfad-Index: erster Treffer in DFS-Reihenfolge (Kinder in Originalreihenfolge)
+    path_index: Dict[tuple, int] = {}
+    stack2 = [(v, (labels[v],)) for v in reversed(tops)]
+    while stack2:
+        v, path = stack2.pop()
+        path_index.setdefault(path, v)
+        stack2.extend((c, path + (labels[c],)) for c in reversed(children[v]))
+
+    has_kids = np.array([bool(ch) for ch in children], dtype=bool)
+    totals, counts, present, covered = _rollup_values(df, models, row_node, parent, depth, has_kids)
+
+    top_rows = row_node[parent[row_node] < 0]
+    return Rollup(
+        ids=ids, labels=labels, parent=parent, parent_ids=parent_ids, row_node=row_node,
+        order=order, pos=pos, size=size, path_index=path_index,
+        col={m: j for j, m in enumerate(models)},
+        totals=totals, counts=counts, present=present, covered=covered,
+        root_totals=_seq_sum(totals[top_rows]),
+        root_count=float(_seq_sum(counts[top_rows][:, None])[0]),
+        has_top=len(top_rows) > 0,
+    )
+
+@timed("builder.rollup_update")
+def update_rollup_columns(rollup: Rollup, df: pd.DataFrame, models: List[str]) -> Rollup:
+    """
+    Kopie von `rollup`, in der nur die Spalten `models` (neu oder geändert) neu berechnet sind.
+    Nur gültig, solange sich die ID-Hierarchie (IDs, Zeilen, Eltern) nicht geändert hat.
+    """
+    n = len(rollup.ids)
+    depth = np.array([1 + i.count(".") for i in rollup.ids], dtype=np.int64)
+    has_kids = np.bincount(rollup.parent[rollup.parent >= 0], minlength=n) > 0
+    totals, _, present, covered = _rollup_values(df, models, rollup.row_node, rollup.parent, depth, has_kids)
+
+    col = dict(rollup.col)
+    for m in models:
+        col.setdefault(m, len(col))
+    width = len(col)
+    def widen(old: np.ndarray, new: np.ndarray) -> np.ndarray:
+        out = np.zeros((n, width), dtype=old.dtype)
+        out[:, :old.shape[1]] = old
+        out[:, [col[m] for m in models]] = new
+        return out
+
+    all_totals = widen(rollup.totals, totals)
+    top_rows = rollup.row_node[rollup.parent[rollup.row_node] < 0]
+    return replace(
+        rollup, col=col, totals=all_totals,
+        present=widen(rollup.present, present), covered=widen(rollup.covered, covered),
+        root_totals=_seq_sum(all_totals[top_rows]),
+    )
+
+@timed("builder.treemap")
 def build_treemap_for_model(
     df: pd.DataFrame,
     meta: dict,
     model: str,
-    path_parts: List[str] | None = None
+    path_parts: List[str] | None = None,
+    rollup: Rollup | None = None,
+    max_nodes: int | None = None,
 ) -> Dict[str, List[Any]]:
+    """
+    Plotly-Arrays (labels, parents, values, ids) für ein Modell, optional ab einem Label-Pfad.
+    Mit vorberechnetem `rollup` nur noch Slice + Array-Aufbau; mit max_nodes über lod_treemap begrenzt.
+    """
     if model not in df.columns:
         raise ValueError(f"Modell '{model}' nicht gefunden.")
+    if rollup is None:
+        rollup = build_rollup(df, meta)
+    j = rollup.col[model]
+    root = f"{model}__root"
 
-    parent_map: dict = meta["parent_map"]
-    label_map: dict = meta["label_map"]
-    children_map: dict = meta["children_map"]
+    # --- Pfadanker über Label-Pfad-Index ---
+    anchor = rollup.path_index.get(tuple(path_parts)) if path_parts else None
 
-    # --- Pfadanker finden (optional) ---
-    def _dfs_label(cur_id: str, parts: List[str]) -> str | None:
-        if not parts:
-            return cur_id
-        want0, rest = parts[0], parts[1:]
-        for ch in children_map.get(cur_id, []):
-            if label_map.get(ch, "") == want0:
-                r = _dfs_label(ch, rest)
-                if r:
-                    return r
-        return None
-
-    anchor_id = None
-    if path_parts:
-        # künstliche Root = "" -> Top-Level IDs
-        for top in children_map.get("", []):
-            if label_map.get(top, "") == path_parts[0]:
-                anchor_id = _dfs_label(top, path_parts[1:])
-                if anchor_id:
-                    break
-
-    # --- IDs im Scope bestimmen ---
-    if anchor_id:
-        ids = _collect_subtree_ids(anchor_id, children_map)
+    if anchor is not None:
+        p = rollup.pos[anchor]
+        nodes = rollup.order[p:p + rollup.size[anchor]]
+        root_value = float(rollup.totals[anchor, j])
+        if root_value == 0.0:
+            vals = rollup.counts[nodes]
+            root_value = float(rollup.counts[anchor])
+        else:
+            vals = rollup.totals[nodes, j]
+        ids_arr = [rollup.ids[i] for i in nodes.tolist()]
+        par = rollup.parent_ids[nodes]
+        par[0] = None                            # Eltern des Ankers liegen außerhalb des Scopes
     else:
-        ids = list(df["ID"].astype(str).values)
-
-    id_set = set(ids)
-
-    # --- Basiswerte je ID aus der Modellspalte ---
-    s = df.set_index("ID")[model]
-
-    def base_value(val) -> float:
-        # numeric -> float; NaN -> 0; strings: non-empty -> 1 (Präsenz), sonst 0
-        try:
-            v = float(val)
-            if math.isnan(v):
-                return 0.0
-            return v
-        except Exception:
-            if val is None:
-                return 0.0
-            txt = str(val).strip()
-            if txt == "" or txt.lower() == "nan":
-                return 0.0
-            return 1.0
-
-    base = {i: base_value(s.get(i)) for i in ids}
-
-    # --- Children-Map auf Scope filtern + Tiefe ---
-    children_scoped = {i: [c for c in children_map.get(i, []) if c in id_set] for i in ids}
-
-    def depth(i: str) -> int:
-        return 1 + (i.count(".") if isinstance(i, str) else 0)
-
-    # --- Bottom-Up Roll-Up: Eltern = Summe der Kinder (falls vorhanden), sonst Basiswert ---
-    totals: Dict[str, float] = {}
-    for i in sorted(ids, key=depth, reverse=True):  # tiefste zuerst
-        kids = children_scoped.get(i, [])
-        if kids:
-            ssum = sum(totals.get(k, 0.0) for k in kids)
-            if ssum == 0.0:
-                # Wenn Kinder 0 sind, nimm wenigstens den Basiswert (falls vorhanden)
-                totals[i] = base.get(i, 0.0)
-            else:
-                totals[i] = ssum
+        nodes = rollup.row_node
+        root_value = float(rollup.root_totals[j]) if rollup.has_top else 0
+        if root_value == 0.0:
+            vals = rollup.counts[nodes]
+            root_value = rollup.root_count if rollup.has_top else 0
         else:
-            totals[i] = base.get(i, 0.0)
+            vals = rollup.totals[nodes, j]
+        ids_arr = df["ID"].astype(str).tolist()
+        par = rollup.parent_ids[nodes]
 
-    # --- Root & Top-Level bestimmen ---
-    root = f"{model}__root"
-    top_ids = [i for i in ids if parent_map.get(i, "") not in id_set]
-    root_value = sum(totals.get(i, 0.0) for i in top_ids)
-
-    # Fallback: wenn alles 0, nutze "count" (alle Blätter = 1)
-    if root_value == 0.0:
-        leaves = [i for i in ids if not children_scoped.get(i)]
-        for i in leaves:
-            totals[i] = 1.0
-        for i in sorted(ids, key=depth, reverse=True):
-            kids = children_scoped.get(i, [])
-            if kids:
-                totals[i] = sum(totals.get(k, 0.0) for k in kids)
-        root_value = sum(totals.get(i, 0.0) for i in top_ids)
-
-    # --- Arrays für Plotly ---
-    labels, parents, values, ids_arr = [], [], [], []
-    labels.append(model); parents.append(""); values.append(root_value); ids_arr.append(root)
-
-    for _id in ids:
-        lab = label_map.get(_id, _id)
-        par = parent_map.get(_id, "")
-        par_plot = par if par in id_set else root  # fehlende Eltern an Root hängen
-        labels.append(lab)
-        parents.append(par_plot)
-        values.append(float(totals.get(_id, 0.0)))
-        ids_arr.append(_id)
-
-    return {"labels": labels, "parents": parents, "values": values, "ids": ids_arr}
+    # --- Arrays für Plotly --- (fehlende Eltern an Root hängen)
+    labels = [model] + rollup.labels[nodes].tolist()
+    parents = [""] + [root if x is None else x for x in par.tolist()]
+    values = [root_value] + vals.tolist()
+    arr = {"labels": labels, "parents": parents, "values": values, "ids": [root] + ids_arr}
+    return lod_treemap(arr, max_nodes) if max_nodes is not None else arr
+
+def lod_treemap(arr: Dict[str, List[Any]], max_nodes: int) -> Dict[str, List[Any]]:
+    """
+    Plotly-Arrays auf max. max_nodes Knoten begrenzen: die kleinsten Geschwister (nach Roll-up-Wert)
+    werden zu "other (n items)" mit der Summe ihrer Werte zusammengefasst. "merged" = Anzahl
+    zusammengefasster Knoten je Eintrag (0 = echter Knoten).
+    """
+    ids, parents, values = arr["ids"], arr["parents"], arr["values"]
+    if len(ids) <= max_nodes:
+        return {**arr, "merged": [0] * len(ids)}
+    at = {i: k for k, i in enumerate(ids)}
+    parent = [at.get(p, -1) for p in parents]
+    keep, merged = select_lod_nodes(parent, values, max_nodes)
+    out = {
+        "labels": [arr["labels"][k] for k in keep],
+        "parents": [parents[k] for k in keep],
+        "values": [values[k] for k in keep],
+        "ids": [ids[k] for k in keep],
+        "merged": [0] * len(keep),
+    }
+    for p, rest in merged.items():
+        out["labels"].append(lod_label(len(rest)))
+        out["parents"].append(ids[p])
+        out["values"].append(float(sum(values[c] for c in rest)))
+        out["ids"].append(f"{ids[p]}__other")
+        out["merged"].append(len(rest))
+    return out
@@ -0,0 +1,157 @@
+# services/catalog.py
+"""
+Gemeinsamer Katalog im Cache-Ordner (SQLite, WAL): dataset_id -> Bundle-Key, Inhalts-Digests,
+Versionen der Bundle-Dateien, PATCH-Sperren und Upload-Jobs. Alle uvicorn-Worker eines Hosts öffnen
+dieselbe Datei; die Bundles selbst liegen daneben als <key>.bundle und werden je Worker per mmap
+eingeblendet.
+"""
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+import json
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS aliases (ds_id TEXT PRIMARY KEY, key TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS aliases_key ON aliases (key);
+CREATE TABLE IF NOT EXISTS digests (digest TEXT PRIMARY KEY, key TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS digests_key ON digests (key);
+CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, doc TEXT NOT NULL, finished REAL);
+CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, until REAL NOT NULL);
+"""
+
+class Catalog:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # eine Verbindung je Thread (sqlite3-Verbindungen nicht zwischen Threads teilen)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self) -> Iterator[sqlite3.Connection]:
+        """ Schreibtransaktion; BEGIN IMMEDIATE sperrt sofort auch gegen andere Prozesse. """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _one(self, sql: str, args: tuple = ()) -> Optional[Any]:
+        # fetchall schließt das Statement; ein offenes hielte den Lese-Snapshot (WAL) fest
+        rows = self._conn().execute(sql, args).fetchall()
+        return rows[0][0] if rows else None
+
+    # ---------- Datasets ----------
+    def add_bundle(self, key: str, ds_id: str, digests: Iterable[str]) -> None:
+        with self._tx() as c:
+            c.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?)", (ds_id, key))
+            c.executemany("INSERT OR REPLACE INTO digests VALUES (?, ?)", [(d, key) for d in digests])
+
+    def alias_key(self, ds_id: str) -> Optional[str]:
+        return self._one("SELECT key FROM aliases WHERE ds_id = ?", (ds_id,))
+
+    def digest_key(self, digest: str) -> Optional[str]:
+        return self._one("SELECT key FROM digests WHERE digest = ?", (digest,))
+
+    def alias_count(self, key: str) -> int:
+        return self._one("SELECT COUNT(*) FROM aliases WHERE key = ?", (key,)) or 0
+
+    def add_alias(self, ds_id: str, key: str) -> bool:
+        """ Neuer Alias auf ein bestehendes Bundle; False, falls es inzwischen freigegeben wurde. """
+        with self._tx() as c:
+            if not c.execute("SELECT 1 FROM aliases WHERE key = ? LIMIT 1", (key,)).fetchall():
+                return False
+            c.execute("INSERT INTO aliases VALUES (?, ?)", (ds_id, key))
+            return True
+
+    def add_digest(self, digest: str, key: str) -> None:
+        with self._tx() as c:
+            c.execute("INSERT OR REPLACE INTO digests VALUES (?, ?)", (digest, key))
+
+    def drop_digests(self, key: str) -> None:
+        with self._tx() as c:
+            c.execute("DELETE FROM digests WHERE key = ?", (key,))
+
+    def move_alias(self, ds_id: str, key: str) -> None:
+        with self._tx() as c:
+            c.execute("UPDATE aliases SET key = ? WHERE ds_id = ?", (key, ds_id))
+
+    def release(self, ds_id: str) -> Tuple[Optional[str], int]:
+        """ Alias entfernen -> (Bundle-Key, verbleibende Aliase); beim letzten auch die Digests. """
+        with self._tx() as c:
+            rows = c.execute("SELECT key FROM aliases WHERE ds_id = ?", (ds_id,)).fetchall()
+            if not rows:
+                return None, 0
+            key = rows[0][0]
+            c.execute("DELETE FROM aliases WHERE ds_id = ?", (ds_id,))
+            left = c.execute("SELECT COUNT(*) FROM aliases WHERE key = ?", (key,)).fetchall()[0][0]
+            if left == 0:
+                c.execute("DELETE FROM digests WHERE key = ?", (key,))
+                c.execute("DELETE FROM versions WHERE key = ?", (key,))
+            return key, left
+
+    def counts(self) -> Tuple[int, int]:
+        """ (dataset_ids, Bundles) """
+        (row,) = self._conn().execute("SELECT COUNT(*), COUNT(DISTINCT key) FROM aliases").fetchall()
+        return row[0], row[1]
+
+    # ---------- Bundle-Dateien ----------
+    def bundle_version(self, key: str) -> int:
+        """ Version der Bundle-Datei (0 = noch nie über swap_bundle geschrieben). """
+        return self._one("SELECT version FROM versions WHERE key = ?", (key,)) or 0
+
+    def swap_bundle(self, key: str, expected: int, commit: Callable[[], None]) -> Optional[int]:
+        """
+        Compare-and-swap: commit() (z.B. os.replace der neu geschriebenen Datei) nur, wenn die Datei
+        noch Version `expected` hat -> neue Version; sonst (anderer Worker war schneller) None.
+        """
+        with self._tx() as c:
+            rows = c.execute("SELECT version FROM versions WHERE key = ?", (key,)).fetchall()
+            current = rows[0][0] if rows else 0
+            if current != expected:
+                return None
+            commit()
+            c.execute("INSERT OR REPLACE INTO versions VALUES (?, ?)", (key, current + 1))
+            return current + 1
+
+    def acquire_lease(self, name: str, owner: str, seconds: float) -> bool:
+        """ Prozessübergreifende Sperre `name` (z.B. PATCH eines Bundles); läuft nach `seconds` ab. """
+        with self._tx() as c:
+            now = time.time()
+            rows = c.execute("SELECT owner, until FROM leases WHERE name = ?", (name,)).fetchall()
+            if rows and rows[0][0] != owner and rows[0][1] > now:
+                return False
+            c.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (name, owner, now + seconds))
+            return True
+
+    def release_lease(self, name: str, owner: str) -> None:
+        with self._tx() as c:
+            c.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    # ---------- Upload-Jobs ----------
+    def put_job(self, job: Dict[str, Any]) -> None:
+        finished = time.time() if job["status"] in ("done", "error") else None
+        with self._tx() as c:
+            c.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)", (job["job_id"], json.dumps(job), finished))
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        doc = self._one("SELECT doc FROM jobs WHERE job_id = ?", (job_id,))
+        return json.loads(doc) if doc else None
+
+    def prune_jobs(self, keep_seconds: float) -> None:
+        with self._tx() as c:
+            c.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (time.time() - keep_seconds,))
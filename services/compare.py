@@ -1,15 +1,82 @@
 # services/compare.py
-from .builder import build_treemap_for_model
+from typing import Any, Dict, List
+import numpy as np
 import pandas as pd
 
+from .builder import build_treemap_for_model, build_rollup, Rollup
+from .metrics import timed
+
 def compare_two_models(
     df: pd.DataFrame,
     meta: dict,
     model_a: str,
     model_b: str,
-    section: str | None = None
+    section: str | None = None,
+    rollup: Rollup | None = None,
 ):
     parts = [section] if section else None
-    a = build_treemap_for_model(df, meta, model_a, parts)
-    b = build_treemap_for_model(df, meta, model_b, parts)
+    rollup = rollup if rollup is not None else build_rollup(df, meta)
+    a = build_treemap_for_model(df, meta, model_a, parts, rollup=rollup)
+    b = build_treemap_for_model(df, meta, model_b, parts, rollup=rollup)
     return {"a": a, "b": b}
+
+@timed("compare.models")
+def compare_models(
+    rollup: Rollup,
+    models: List[str],
+    baseline: str | None = None,
+    section: str | None = None,
+) -> Dict[str, Any]:
+    """
+    N-Wege-Vergleich in einem Durchlauf über die vorberechneten Roll-ups:
+    pro Knoten Präsenz (eigener Wert), Abdeckung (Wert im Teilbaum), Roll-up-Wert
+    und Delta gegenüber dem Baseline-Modell.
+    section = Label eines Top-Level-Knotens (wie compare_two_models), None = ganzes Dataset.
+    """
+    if not models:
+        raise ValueError("Keine Modelle angegeben.")
+    missing = [m for m in models if m not in rollup.col]
+    if missing:
+        raise ValueError(f"Modell(e) nicht gefunden: {', '.join(missing)}")
+    baseline = baseline or models[0]
+    if baseline not in rollup.col:
+        raise ValueError(f"Baseline '{baseline}' nicht gefunden.")
+
+    if section:
+        anchor = rollup.path_index.get((section,))
+        if anchor is None:
+            raise ValueError(f"Abschnitt '{section}' nicht gefunden.")
+        p = rollup.pos[anchor]
+        nodes = rollup.order[p:p + rollup.size[anchor]]
+        par = rollup.parent_ids[nodes]
+        par[0] = None
+    else:
+        nodes = np.arange(len(rollup.ids))
+        par = rollup.parent_ids
+
+    cols = [rollup.col[m] for m in models]
+    vals = rollup.totals[np.ix_(nodes, cols)]             # Knoten x gewählte Modelle
+    pres = rollup.present[np.ix_(nodes, cols)]
+    sub_pres = rollup.covered[np.ix_(nodes, cols)]
+    delta = vals - rollup.totals[nodes, rollup.col[baseline]][:, None]
+
+    return {
+        "models": models,
+        "baseline": baseline,
+        "section": section,
+        "ids": [rollup.ids[i] for i in nodes.tolist()],
+        "labels": rollup.labels[nodes].tolist(),
+        "parents": ["" if x is None else x for x in par.tolist()],
+        "values": {m: vals[:, k].tolist() for k, m in enumerate(models)},
+        "present": {m: pres[:, k].tolist() for k, m in enumerate(models)},
+        "covered": {m: sub_pres[:, k].tolist() for k, m in enumerate(models)},
+        "delta": {m: delta[:, k].tolist() for k, m in enumerate(models)},
+        "summary": {
+            m: {
+                "present_nodes": int(pres[:, k].sum()),
+                "only_here": int((pres[:, k] & (pres.sum(axis=1) == 1)).sum()),
+                "missing_vs_baseline": int((~pres[:, k] & pres[:, models.index(baseline)]).sum()),
+            }
+            for k, m in enumerate(models)
+        },
+    }
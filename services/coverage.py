@@ -0,0 +1,120 @@
+# services/coverage.py
+"""
+Modell-Abdeckung je Anforderung über die geteilte ID-Hierarchie (builder.Rollup), als Bitset je Knoten:
+Bit j = Modell models[j] (bei > 64 Modellen mehrere uint64-Wörter je Knoten).
+- present: eigene Zelle hat einen Wert (_is_truthy-Regel)
+- covered: Knoten oder ein Nachfahre hat einen Wert (zu den Vorfahren hochgerollt)
+Beantwortet "welche Modelle füllen 3.3.x", "wo fehlen diese Modelle" und "Rangfolge nach Abdeckung",
+ohne einen Modellbaum zu bauen.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+from .builder import Rollup
+from .metrics import timed
+
+MODES = ("covered", "present")
+
+@dataclass
+class Coverage:
+    models: List[str]              # Bit-Reihenfolge (= Spalten des Roll-ups)
+    present: np.ndarray            # (Knoten x Wörter) uint64
+    covered: np.ndarray            # (Knoten x Wörter) uint64
+    node_of: Dict[str, int]        # ID -> Knoten
+
+def _pack(mat: np.ndarray) -> np.ndarray:
+    """ (Knoten x Modelle) bool -> (Knoten x Wörter) uint64, Bit j von Wort w = Modell 64*w + j. """
+    n, m = mat.shape
+    words = max(1, (m + 63) // 64)
+    padded = np.zeros((n, words * 64), dtype=bool)
+    padded[:, :m] = mat
+    return np.packbits(padded.reshape(n, words, 64), axis=2, bitorder="little").view("<u8").reshape(n, words)
+
+def _unpack(bits: np.ndarray, m: int) -> np.ndarray:
+    """ Umkehrung von _pack für (Knoten x Wörter) -> (Knoten x m) bool. """
+    return np.unpackbits(bits.view(np.uint8), axis=1, bitorder="little")[:, :m].astype(bool)
+
+@timed("coverage.build")
+def build_coverage(rollup: Rollup) -> Coverage:
+    models = sorted(rollup.col, key=rollup.col.get)
+    return Coverage(
+        models=models,
+        present=_pack(rollup.present),
+        covered=_pack(rollup.covered),
+        node_of={i: k for k, i in enumerate(rollup.ids)},
+    )
+
+def _bits(cov: Coverage, mode: str) -> np.ndarray:
+    if mode not in MODES:
+        raise ValueError(f"Unbekannter Modus '{mode}' ({'/'.join(MODES)}).")
+    return cov.covered if mode == "covered" else cov.present
+
+def _mask(cov: Coverage, models: List[str]) -> np.ndarray:
+    missing = [m for m in models if m not in cov.models]
+    if missing:
+        raise ValueError(f"Modell(e) nicht gefunden: {', '.join(missing)}")
+    mask = np.zeros((1, cov.present.shape[1] * 64), dtype=bool)
+    mask[0, [cov.models.index(m) for m in models]] = True
+    return _pack(mask)[0]
+
+def _names(cov: Coverage, bits: np.ndarray) -> List[List[str]]:
+    """ Bitset-Zeilen -> Modellnamen je Zeile. """
+    flags = _unpack(bits, len(cov.models))
+    return [[cov.models[j] for j in np.flatnonzero(row)] for row in flags]
+
+def _scope(rollup: Rollup, cov: Coverage, node: Optional[str]) -> np.ndarray:
+    """ Knoten im Teilbaum von `node` (ID) in Traversierungsreihenfolge, ohne node: alle Knoten. """
+    if not node:
+        return np.arange(len(rollup.ids))
+    v = cov.node_of.get(node)
+    if v is None:
+        raise ValueError(f"Knoten '{node}' nicht gefunden.")
+    p = rollup.pos[v]
+    return rollup.order[p:p + rollup.size[v]] if p >= 0 else np.array([v])
+
+def _entries(rollup: Rollup, cov: Coverage, nodes: np.ndarray) -> List[Dict[str, Any]]:
+    present = _names(cov, cov.present[nodes])
+    covered = _names(cov, cov.covered[nodes])
+    return [{"id": rollup.ids[v], "label": rollup.labels[v], "present": p, "covered": c}
+            for v, p, c in zip(nodes.tolist(), present, covered)]
+
+def node_coverage(rollup: Rollup, cov: Coverage, node: Optional[str] = None) -> Dict[str, Any]:
+    """ Abdeckung eines Knotens (ID) und seiner Kinder; ohne node: die Top-Level-Knoten. """
+    if node:
+        v = cov.node_of.get(node)
+        if v is None:
+            raise ValueError(f"Knoten '{node}' nicht gefunden.")
+        head = _entries(rollup, cov, np.array([v]))[0]
+    else:
+        v, head = -1, None
+    kids = np.flatnonzero(rollup.parent == v)
+    return {"models": cov.models, "node": head, "children": _entries(rollup, cov, kids)}
+
+def missing_nodes(rollup: Rollup, cov: Coverage, models: List[str], node: Optional[str] = None,
+                  mode: str = "covered", limit: int = 1000) -> Dict[str, Any]:
+    """ Knoten (im Teilbaum von node), denen mindestens eines der `models` fehlt, mit den fehlenden Modellen. """
+    if not models:
+        raise ValueError("Keine Modelle angegeben.")
+    mask = _mask(cov, models)
+    nodes = _scope(rollup, cov, node)
+    lack = mask & ~_bits(cov, mode)[nodes]          # gewählte Modelle ohne Bit, je Knoten
+    hit = nodes[lack.any(axis=1)]
+    shown = hit[:max(0, limit)]
+    missing = _names(cov, mask & ~_bits(cov, mode)[shown])
+    return {
+        "models": models, "mode": mode, "total": int(len(hit)),
+        "nodes": [{"id": rollup.ids[v], "label": rollup.labels[v], "missing": ms}
+                  for v, ms in zip(shown.tolist(), missing)],
+    }
+
+def rank_models(rollup: Rollup, cov: Coverage, node: Optional[str] = None, mode: str = "covered") -> Dict[str, Any]:
+    """ Modelle nach Anzahl abgedeckter Knoten (im Teilbaum von node), absteigend. """
+    nodes = _scope(rollup, cov, node)
+    counts = _unpack(_bits(cov, mode)[nodes], len(cov.models)).sum(axis=0)
+    total = len(nodes)
+    ranking = sorted(zip(cov.models, counts.tolist()), key=lambda x: (-x[1], x[0]))
+    return {
+        "mode": mode, "total": total,
+        "ranking": [{"model": m, "nodes": int(c), "share": c / total if total else 0.0} for m, c in ranking],
+    }
@@ -0,0 +1,94 @@
+# services/export.py
+"""
+Bulk-Export eines Datasets für Analysejobs, blockweise aus dem Bundle erzeugt und unterwegs komprimiert
+(nie der ganze Export im Speicher). Zwei Tabellen:
+- rollup: eine Zeile je (Knoten der ID-Hierarchie, Modell), modellweise:
+  id, label, parent (Eltern-ID, null = Top-Level/verwaist), model, value (Zelle als Text, null = leer),
+  present, covered (Knoten bzw. Teilbaum hat einen Wert), total (Treemap-Roll-up wie /treemap),
+  leaves (Blattanzahl, Fallback-Roll-up)
+- tree: die geprunten Modellbäume (wie /tree) als Knotentabelle, eine Zeile je Knoten in Pre-Order:
+  model, node (Nummer im Modellbaum, Root = 0), parent (null = Root), name
+Format: NDJSON, gzip-komprimiert, falls der Client es annimmt.
+"""
+from typing import Any, Callable, Dict, Iterator, List
+import zlib
+import numpy as np
+import pandas as pd
+
+from .builder import Rollup
+from .tree import _is_truthy
+from .metrics import count
+
+BATCH_NODES = 8192
+
+TABLES = ("rollup", "tree")
+FORMATS = ("ndjson",)
+
+def check_format(table: str, fmt: str) -> None:
+    if table not in TABLES:
+        raise ValueError(f"Unbekannte Tabelle '{table}' ({'/'.join(TABLES)}).")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unbekanntes Format '{fmt}' ({'/'.join(FORMATS)}).")
+
+def export_batches(df: pd.DataFrame, rollup: Rollup, batch_nodes: int = BATCH_NODES) -> Iterator[Dict[str, np.ndarray]]:
+    """ Spalten-Blöcke (numpy, je max. batch_nodes Knoten eines Modells) in Exportreihenfolge. """
+    n = len(rollup.ids)
+    _, first_row = np.unique(rollup.row_node, return_index=True)   # erste DF-Zeile je Knoten
+    ids = np.array(rollup.ids, dtype=object)
+    for m, j in sorted(rollup.col.items(), key=lambda x: x[1]):
+        cells = df[m].to_numpy(dtype=object)[first_row]
+        for a in range(0, n, batch_nodes):
+            sl = slice(a, a + batch_nodes)
+            k = len(cells[sl])
+            yield {
+                "id": ids[sl],
+                "label": rollup.labels[sl],
+                "parent": rollup.parent_ids[sl],
+                "model": np.full(k, m, dtype=object),
+                "value": np.array([str(v).strip() if _is_truthy(v) else None for v in cells[sl]], dtype=object),
+                "present": rollup.present[sl, j],
+                "covered": rollup.covered[sl, j],
+                "total": rollup.totals[sl, j],
+                "leaves": rollup.counts[sl],
+            }
+            count("export_rows", k)
+
+def tree_batches(models: List[str], get_tree: Callable[[str], Dict[str, Any]],
+                 batch_rows: int = BATCH_NODES) -> Iterator[Dict[str, np.ndarray]]:
+    """ Knotentabellen der geprunten Bäume (Pre-Order), modellweise; Bäume werden bei Bedarf gebaut. """
+    for m in models:
+        node_ids: List[int] = []
+        parents: List[int] = []
+        names: List[str] = []
+        stack = [(get_tree(m), -1)]
+        while stack:
+            node, p = stack.pop()
+            me = len(names)
+            node_ids.append(me)
+            parents.append(p)
+            names.append(node.get("name", ""))
+            stack.extend((ch, me) for ch in reversed(node.get("children") or []))
+        for a in range(0, len(names), batch_rows):
+            k = len(names[a:a + batch_rows])
+            par = np.array(parents[a:a + batch_rows], dtype=object)
+            par[par == -1] = None
+            yield {
+                "model": np.full(k, m, dtype=object),
+                "node": np.array(node_ids[a:a + batch_rows], dtype=np.int64),
+                "parent": par,
+                "name": np.array(names[a:a + batch_rows], dtype=object),
+            }
+            count("export_rows", k)
+
+def export_stream(batches: Iterator[Dict[str, np.ndarray]], gzip: bool = True) -> Iterator[bytes]:
+    """ Blöcke (export_batches / tree_batches) als NDJSON-Byte-Stream, optional gzip. """
+    z = zlib.compressobj(3, zlib.DEFLATED, 31) if gzip else None    # wbits 31 = gzip-Container; Stufe 3: ~2x schneller als 6
+    for cols in batches:
+        # JSON-Encoder von pandas (C) statt json.dumps je Zeile; 15 Stellen = volle float-Genauigkeit
+        lines = pd.DataFrame(cols).to_json(orient="records", lines=True, force_ascii=False,
+                                           double_precision=15).encode("utf-8")
+        out = z.compress(lines) if z else lines
+        if out:
+            yield out
+    if z:
+        yield z.flush()
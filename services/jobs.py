@@ -0,0 +1,236 @@
+# services/jobs.py
+"""
+Hintergrund-Ingestion: Parsen + Baum-/Indexbau laufen in einem Prozess-Pool,
+damit /tree und /search auf dem Event-Loop nicht blockiert werden.
+Fortschritt kommt über eine Queue aus den Worker-Prozessen zurück.
+"""
+from typing import Dict, Any, List, Optional, Union
+from uuid import uuid4
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing as mp
+import threading
+import os
+
+from .loader import load_table, frame_digest
+from .tree import build_all_model_trees, parse_hierarchy
+from .search import SegmentPool
+from .builder import build_rollup
+from .store import InMemoryStore
+from . import metrics
+
+_progress_q = None  # im Worker-Prozess gesetzt (Pool-Initializer)
+
+def _init_worker(q) -> None:
+    global _progress_q
+    _progress_q = q
+
+def _report(job_id: str, stage: str, **info) -> None:
+    if _progress_q is not None:
+        _progress_q.put((job_id, stage, info))
+
+def run_ingest(job_id: str, source: Union[bytes, str], filename: str, dedup_frame: bool,
+               warm_max_cells: int = 0) -> Dict[str, Any]:
+    """
+    Läuft im Worker-Prozess: Parsen -> Hierarchie + Treemap-Roll-ups (einmal für alle Modelle).
+    Bäume + Suchindex je Modell entstehen lazy beim ersten /tree bzw. /search;
+    nur kleine Tabellen (Zeilen x Modelle <= warm_max_cells) werden sofort komplett gebaut.
+    """
+    _report(job_id, "parse", done=0, total=1)
+    frames, meta = load_table(source, filename)
+    _report(job_id, "parse", done=1, total=1)
+    df = frames["main"]
+    df_digest = frame_digest(df) if dedup_frame else None
+    hier = parse_hierarchy(df)
+    pool = SegmentPool()
+    rollup = build_rollup(df, meta)
+    _report(job_id, "hierarchy", done=1, total=1)
+
+    trees, index = {}, {}
+    if len(df) * len(meta["model_cols"]) <= warm_max_cells:
+        def progress(stage: str, done: int, total: int, model: str) -> None:
+            _report(job_id, stage, done=done, total=total, model=model)
+
+        trees, index = build_all_model_trees(df, progress=progress, hier=hier, pool=pool)
+    return {"frames": frames, "meta": meta, "trees": trees, "index": index, "hier": hier, "pool": pool,
+            "rollup": rollup, "frame_digest": df_digest, "metrics": metrics.drain()}
+
+# abgeschlossene Jobs im gemeinsamen Katalog so lange abrufbar halten
+_FINISHED_JOB_SECONDS = 3600
+
+class JobQueueFull(Exception):
+    pass
+
+class IngestJobs:
+    """
+    Verwaltet Upload-Jobs.
+    - max_workers: parallele Ingestion-Prozesse (CPU-Limit)
+    - max_pending: max. wartende + laufende Jobs, darüber -> JobQueueFull
+    - warm_max_cells: Tabellen bis zu dieser Größe (Zeilen x Modelle) werden sofort komplett gebaut
+    Hat der Store einen Katalog (mehrere uvicorn-Worker), wird jeder Jobstand dort veröffentlicht:
+    /jobs/{id} funktioniert dann auch, wenn der Poll bei einem anderen Worker landet.
+    """
+    def __init__(self, store: InMemoryStore, max_workers: int = 2, max_pending: int = 32,
+                 dedup_frame: bool = True, keep_finished: int = 1000, warm_max_cells: int = 0) -> None:
+        self.store = store
+        self.warm_max_cells = warm_max_cells
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.dedup_frame = dedup_frame
+        self.keep_finished = keep_finished
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._active = 0
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._queue = None
+
+    # ---------- öffentliche API ----------
+    def submit(self, source: Union[bytes, str], filename: str, raw_digest: str) -> str:
+        """
+        source: Dateiinhalt oder Pfad einer gespoolten Upload-Datei (upload.spool_upload).
+        Ein Pfad gehört ab hier dem Job und wird gelöscht, sobald er nicht mehr gebraucht wird.
+        """
+        job_id = uuid4().hex
+        job = {
+            "job_id": job_id, "filename": filename, "status": "queued", "stage": None,
+            "stages": {}, "dataset_id": None, "models": None, "error": None,
+        }
+        # Identische Datei schon gebaut -> Job ist sofort fertig
+        ds_id = self.store.attach(raw_digest)
+        if ds_id:
+            _discard(source)
+            models = self.store.get(ds_id).models()  # lädt ggf. von der Platte -> nicht unter self._lock
+            with self._lock:
+                self._finish(job, ds_id, models)
+                self._remember(job)
+            return job_id
+        with self._lock:
+            if self._active >= self.max_pending:
+                _discard(source)
+                raise JobQueueFull(f"Zu viele laufende Uploads (max {self.max_pending}).")
+            self._active += 1
+            self._remember(job)
+        try:
+            fut = self._ensure_pool().submit(run_ingest, job_id, source, filename, self.dedup_frame,
+                                             self.warm_max_cells)
+        except BaseException:
+            with self._lock:
+                self._active -= 1
+                self._jobs.pop(job_id, None)
+            _discard(source)
+            raise
+        fut.add_done_callback(lambda f: self._on_done(job_id, raw_digest, f, source))
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return {**job, "stages": {k: dict(v) for k, v in job["stages"].items()}}
+        if self.store.catalog is not None:
+            return self.store.catalog.get_job(job_id)  # Job eines anderen Workers
+        return None
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # ---------- intern ----------
+    def _ensure_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                ctx = mp.get_context("spawn")
+                self._queue = ctx.Queue()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=ctx,
+                    initializer=_init_worker, initargs=(self._queue,),
+                )
+                threading.Thread(target=self._drain, args=(self._queue,), daemon=True).start()
+            return self._pool
+
+    def _drain(self, q) -> None:
+        while True:
+            job_id, stage, info = q.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] in ("done", "error"):
+                    continue
+                job["status"] = "running"
+                job["stage"] = stage
+                job["stages"][stage] = info
+                self._publish(job)
+
+    def _on_done(self, job_id: str, raw_digest: str, fut: Future, source: Union[bytes, str]) -> None:
+        _discard(source)  # Worker hat die Datei gelesen (oder ist abgebrochen)
+        try:
+            res = fut.result()
+            metrics.merge(res.get("metrics"))  # Stufen aus dem Worker-Prozess
+            ds_id = self.store.attach(res["frame_digest"]) if res["frame_digest"] else None
+            if ds_id:
+                self.store.link_digest(ds_id, raw_digest)
+            else:
+                digests = [raw_digest] + ([res["frame_digest"]] if res["frame_digest"] else [])
+                ds_id = self.store.create(frames=res["frames"], meta=res["meta"], trees=res["trees"],
+                                          index=res["index"], digests=digests,
+                                          hier=res["hier"], pool=res["pool"], rollup=res["rollup"])
+            models = self.store.get(ds_id).models()
+            with self._lock:
+                self._finish(self._jobs[job_id], ds_id, models)
+        except Exception as e:
+            with self._lock:
+                if isinstance(e, BrokenProcessPool):
+                    self._pool = None  # abgestürzter Worker -> beim nächsten Upload neu starten
+                job = self._jobs[job_id]
+                job["status"] = "error"
+                job["error"] = f"{type(e).__name__}: {e}"
+                self._publish(job)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _finish(self, job: Dict[str, Any], ds_id: str, models: List[str]) -> None:
+        job["status"] = "done"
+        job["stage"] = None
+        job["dataset_id"] = ds_id
+        job["models"] = models
+        self._publish(job)
+
+    def _publish(self, job: Dict[str, Any]) -> None:
+        if self.store.catalog is not None:
+            self.store.catalog.put_job(job)
+
+    def _remember(self, job: Dict[str, Any]) -> None:
+        self._jobs[job["job_id"]] = job
+        self._publish(job)
+        if self.store.catalog is not None:
+            self.store.catalog.prune_jobs(_FINISHED_JOB_SECONDS)
+        # alte, abgeschlossene Jobs begrenzen
+        while len(self._jobs) > self.keep_finished:
+            old = next((k for k, j in self._jobs.items() if j["status"] in ("done", "error")), None)
+            if old is None:
+                break
+            del self._jobs[old]
+
+def _discard(source: Union[bytes, str]) -> None:
+    if isinstance(source, str):
+        try:
+            os.remove(source)
+        except FileNotFoundError:
+            pass
+
+def _env_int(name: str, default: int) -> int:
+    val = os.environ.get(name, "").strip()
+    return int(val) if val else default
+
+def make_jobs(store: InMemoryStore, dedup_frame: bool) -> IngestJobs:
+    # Parallele Ingestion-Prozesse über TABLES_INGEST_WORKERS, Warteschlange über TABLES_INGEST_MAX_PENDING,
+    # sofortiger Komplettbau kleiner Tabellen über TABLES_WARM_MAX_CELLS (0 = immer lazy)
+    return IngestJobs(
+        store,
+        max_workers=_env_int("TABLES_INGEST_WORKERS", max(1, min(4, (os.cpu_count() or 2) // 2))),
+        max_pending=_env_int("TABLES_INGEST_MAX_PENDING", 32),
+        dedup_frame=dedup_frame,
+        warm_max_cells=_env_int("TABLES_WARM_MAX_CELLS", 0),
+    )
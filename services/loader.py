@@ -1,36 +1,197 @@
 # services/loader.py
 import io
+import csv
+import os
+import codecs
+import hashlib
 import pandas as pd
 
+from .metrics import stage, count
+
+try:  # optional: pyarrow (pip install pyarrow) -> schnellerer, mehrkerniger CSV-Parser
+    import pyarrow  # noqa: F401
+    _HAVE_PYARROW = True
+except ImportError:  # pragma: no cover - ohne pyarrow der C-Parser von pandas
+    _HAVE_PYARROW = False
+
 REQUIRED_COLS = ["ID", "Label"]
 
+# CSV-Parser über TABLES_CSV_ENGINE: auto (pyarrow, falls installiert), pyarrow, c
+CSV_ENGINE = os.environ.get("TABLES_CSV_ENGINE", "auto").strip().lower() or "auto"
+
+_SNIFF_BYTES = 64 * 1024
+_DELIMITERS = (",", ";", "\t", "|")
+# Zellinhalte, die read_csv/read_excel standardmäßig als leer werten
+_NA_STRINGS = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+
+def _canonical(col: str) -> str:
+    """ Spaltenname -> Pflichtspalte (Toleranz für Groß-/Kleinschreibung und Synonyme). """
+    c_low = col.lower()
+    if c_low in ("id", "nummer", "no"):
+        return "ID"
+    if c_low in ("label", "name", "titel", "title"):
+        return "Label"
+    return col  # Modellspalten bleiben
+
 def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     cols = [str(c).strip() for c in df.columns]
-    # Toleranz für Groß-/Kleinschreibung
-    map_norm = {}
-    for c in cols:
-        c_low = c.lower()
-        if c_low in ("id", "nummer", "no"):
-            map_norm[c] = "ID"
-        elif c_low in ("label", "name", "titel", "title"):
-            map_norm[c] = "Label"
-        else:
-            map_norm[c] = c  # Modellspalten bleiben
-    df = df.rename(columns=map_norm)
-    return df
+    return df.rename(columns={c: _canonical(c) for c in cols})
 
-def load_table(file_bytes: bytes, filename: str) -> tuple[dict, dict]:
-    name = (filename or "").lower()
-    if name.endswith(".csv"):
-        # Trennzeichen heuristisch (Komma/Semikolon)
+# -------- CSV --------
+def _sniff_encoding(sample: bytes) -> str:
+    """ Encoding aus BOM bzw. Probe: UTF-8, sonst Windows-1252 (Excel-Export), sonst Latin-1. """
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        sample.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        if e.start >= len(sample) - 3 and len(sample) >= _SNIFF_BYTES:
+            return "utf-8"  # nur das letzte Zeichen der Probe abgeschnitten
+    try:
+        sample.decode("cp1252")
+        return "cp1252"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+def _sniff_delimiter(lines: list) -> str:
+    """ Trennzeichen, das in den ersten Zeilen die meisten gleich breiten Zeilen (>= 2 Felder) ergibt. """
+    best, best_score = ",", (0, 0)
+    for d in _DELIMITERS:
+        widths = [len(r) for r in csv.reader(lines, delimiter=d)]
+        if not widths or widths[0] < 2:
+            continue
+        score = (sum(w == widths[0] for w in widths), widths[0])
+        if score > best_score:
+            best, best_score = d, score
+    return best
+
+def _csv_engine() -> str:
+    if CSV_ENGINE == "auto":
+        return "pyarrow" if _HAVE_PYARROW else "c"
+    return CSV_ENGINE
+
+def _source(src: bytes | str):
+    """ bytes -> Datei-Objekt; Pfad (gespoolter Upload) bleibt Pfad und wird gestreamt gelesen. """
+    return src if isinstance(src, str) else io.BytesIO(src)
+
+def _head(src: bytes | str) -> tuple[bytes, int]:
+    """ (erste 64 KB, Gesamtgröße) """
+    if isinstance(src, str):
+        with open(src, "rb") as f:
+            return f.read(_SNIFF_BYTES), os.path.getsize(src)
+    return src[:_SNIFF_BYTES], len(src)
+
+def _read_csv(src: bytes | str) -> pd.DataFrame:
+    """
+    Ein Durchlauf: Encoding + Trennzeichen aus den ersten 64 KB, ID/Label direkt als String
+    (keine Typ-Inferenz für Spalten, die ohnehin Text werden).
+    """
+    sample, size = _head(src)
+    encoding = _sniff_encoding(sample)
+    lines = sample.decode(encoding, errors="ignore").splitlines()
+    if size > _SNIFF_BYTES and len(lines) > 1:
+        lines = lines[:-1]  # letzte Zeile der Probe ist evtl. abgeschnitten
+    lines = lines[:50]
+    sep = _sniff_delimiter(lines)
+    header = next(csv.reader(lines[:1], delimiter=sep), [])
+    dtype = {c: str for c in header if _canonical(c.strip()) in REQUIRED_COLS}
+    kwargs = dict(sep=sep, encoding=encoding, dtype=dtype)
+    engine = _csv_engine()
+    if engine == "pyarrow":
         try:
-            df = pd.read_csv(io.BytesIO(file_bytes))
+            return pd.read_csv(_source(src), engine="pyarrow", **kwargs)
         except Exception:
-            df = pd.read_csv(io.BytesIO(file_bytes), sep=";")
-    else:
-        df = pd.read_excel(io.BytesIO(file_bytes))  # braucht openpyxl
+            pass  # z.B. mehrzeilige Zellen ohne Quote-Unterstützung -> C-Parser
+    return pd.read_csv(_source(src), engine="c", **kwargs)
+
+# -------- XLSX --------
+def _cell(v, na: frozenset):
+    if isinstance(v, str):
+        return None if v in na else v
+    if isinstance(v, float) and v.is_integer():
+        return int(v)  # wie read_excel: 5.0 -> 5
+    return v
+
+def _dedupe(names: list) -> list:
+    """ Doppelte Spaltennamen wie pandas: A, A.1, A.2 """
+    seen: dict = {}
+    out = []
+    for n in names:
+        k = seen.get(n, 0)
+        seen[n] = k + 1
+        out.append(n if k == 0 else f"{n}.{k}")
+    return out
 
-    df = _normalize_columns(df)
+def _read_xlsx(src: bytes | str) -> pd.DataFrame:
+    """
+    Erstes Blatt zeilenweise über openpyxl (read_only, nur Werte) direkt in Spaltenlisten;
+    ohne Zellobjekte und ohne Zwischentabelle aus Zeilenlisten. ID/Label werden Strings,
+    Modellspalten bekommen dieselbe Typ-Inferenz wie bei read_excel (Zahlen, sonst Text/gemischt).
+    """
+    from openpyxl import load_workbook  # braucht openpyxl
+    from openpyxl.cell.cell import ERROR_CODES
+
+    na = _NA_STRINGS.union(ERROR_CODES)  # Fehlerwerte (#DIV/0! ...) wie read_excel als leer
+    wb = load_workbook(_source(src), read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()  # gespeicherte Dimensionen sind oft falsch
+        rows = ws.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        cols: list = [[] for _ in header]
+        n = 0
+        for row in rows:
+            vals = [_cell(v, na) for v in row]
+            if all(v is None for v in vals):
+                continue  # leere Zeilen überspringen (skip_blank_lines)
+            if len(vals) > len(cols):
+                cols.extend([None] * n for _ in range(len(vals) - len(cols)))
+                header.extend([None] * (len(vals) - len(header)))
+            for c, v in zip(cols, vals):
+                c.append(v)
+            for c in cols[len(vals):]:
+                c.append(None)
+            n += 1
+    finally:
+        wb.close()
+
+    # leere Spalten am Ende (ohne Kopf und Werte) wie read_excel abschneiden
+    while cols and header[-1] is None and all(v is None for v in cols[-1]):
+        cols.pop()
+        header.pop()
+    names = _dedupe([f"Unnamed: {i}" if h is None else h for i, h in enumerate(header)])
+    data = {}
+    for name, values in zip(names, cols):
+        if _canonical(str(name).strip()) in REQUIRED_COLS:
+            s = pd.Series([None if v is None else str(v) for v in values], dtype=str)
+        else:
+            s = pd.Series(values, dtype=float if not values else None)
+            if not pd.api.types.is_numeric_dtype(s):
+                try:
+                    s = pd.to_numeric(s)  # reine Zahlen-Spalte (auch als Text gespeichert)
+                except (ValueError, TypeError):
+                    pass
+        data[name] = s
+    return pd.DataFrame(data)
+
+def load_table(src: bytes | str, filename: str) -> tuple[dict, dict]:
+    """ src: Dateiinhalt oder Pfad (z.B. gespoolter Upload); der Typ kommt aus filename. """
+    name = (filename or "").lower()
+    with stage("load.read"):
+        if name.endswith(".csv"):
+            df = _read_csv(src)
+        else:
+            df = _read_xlsx(src)
+    count("rows_parsed", len(df))
+
+    with stage("load.normalize"):
+        df = _normalize_columns(df)
 
     # Pflichtspalten prüfen
     for c in REQUIRED_COLS:
@@ -42,20 +203,21 @@ def load_table(file_bytes: bytes, filename: str) -> tuple[dict, dict]:
     if not model_cols:
         raise ValueError("Keine Modellspalten gefunden (erwartet ab 3. Spalte).")
 
-    # Strings sauber
-    df["ID"] = df["ID"].astype(str).str.strip()
-    df["Label"] = df["Label"].astype(str).str.strip()
+    with stage("load.meta"):
+        meta = _build_meta(df, model_cols)
+    return {"main": df}, meta
 
-    # Meta vorbereiten (Parent-Map aus ID ableiten: '1.2.3' -> '1.2')
-    parent_map = {}
-    for _id in df["ID"]:
-        if "." in _id:
-            parent_map[_id] = _id.rsplit(".", 1)[0]
-        else:
-            parent_map[_id] = ""  # Top-Level
+def _build_meta(df: pd.DataFrame, model_cols: list) -> dict:
+    # Strings sauber; leere Zellen -> "nan" (wie astype(str) vor pandas 3, parse_hierarchy prüft darauf)
+    df["ID"] = df["ID"].fillna("nan").astype(str).str.strip()
+    df["Label"] = df["Label"].fillna("nan").astype(str).str.strip()
+
+    # Meta vorbereiten (Parent-Map aus ID ableiten: '1.2.3' -> '1.2', Top-Level -> '')
+    ids = df["ID"].tolist()  # Listen statt Series-Iteration (große Tabellen)
+    parent_map = dict(zip(ids, [_id.rpartition(".")[0] for _id in ids]))
 
     # Label-Map & Full-Path (für Suche)
-    label_map = dict(zip(df["ID"], df["Label"]))
+    label_map = dict(zip(ids, df["Label"].tolist()))
     # children map (IDs)
     children_map = {}
     for _id, parent in parent_map.items():
@@ -67,5 +229,27 @@ def load_table(file_bytes: bytes, filename: str) -> tuple[dict, dict]:
         "label_map": label_map,
         "children_map": children_map
     }
+    return meta
 
-    return {"main": df}, meta
+# -------- Inhalts-Digests (Upload-Deduplizierung) --------
+def content_digest(file_bytes: bytes) -> str:
+    """ Digest der Rohbytes: gleiche Datei -> gleicher Digest. """
+    return raw_digest(hashlib.sha256(file_bytes))
+
+def raw_digest(h) -> str:
+    """ Digest aus einem (blockweise gefütterten) sha256-Objekt; identisch zu content_digest. """
+    return "raw:" + h.hexdigest()
+
+def frame_digest(df: pd.DataFrame) -> str | None:
+    """
+    Digest des normalisierten DataFrames (Spaltennamen, dtypes + Werte, ohne Index).
+    Erkennt z.B. dieselbe Tabelle einmal als XLSX, einmal als CSV. None, falls nicht hashbar.
+    """
+    h = hashlib.sha256()
+    h.update("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    h.update("\x1f".join(map(str, df.dtypes)).encode("utf-8"))
+    try:
+        h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    except TypeError:
+        return None
+    return "frame:" + h.hexdigest()
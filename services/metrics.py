@@ -0,0 +1,191 @@
+# services/metrics.py
+"""
+Leichtgewichtige Instrumentierung: Latenz-Histogramme je Stufe + Zähler.
+- @timed("tree.build") / with stage("load.read"): Dauer -> Histogramm tables_stage_seconds{stage=...}
+  und (innerhalb eines Requests) -> Server-Timing-Header
+- count("rows_parsed", n): Zähler tables_rows_parsed_total
+- render(): Prometheus-Textformat für /metrics
+Abschaltbar über TABLES_METRICS=0: @timed gibt dann die Funktion unverändert zurück,
+stage()/count() sind No-ops.
+Ingestion läuft in Worker-Prozessen: deren Messwerte kommen per drain() mit dem Ergebnis
+zurück und werden im Hauptprozess mit merge() übernommen.
+"""
+from typing import Dict, List, Tuple, Optional, Any
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+from bisect import bisect_left
+import os
+import re
+import threading
+import time
+
+ENABLED = os.environ.get("TABLES_METRICS", "1").strip().lower() not in ("0", "false", "no")
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stufen des laufenden Requests (name -> [Summe s, Anzahl]); None = kein Request
+_request_timings: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_timings", default=None)
+
+class _Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.hist: Dict[Tuple[str, tuple], List[float]] = {}    # (Metrik, Labels) -> Buckets..., Summe, Anzahl
+        self.counters: Dict[str, float] = {}
+
+    def observe(self, metric: str, labels: tuple, seconds: float) -> None:
+        i = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            h = self.hist.get((metric, labels))
+            if h is None:
+                h = self.hist[(metric, labels)] = [0.0] * (len(BUCKETS) + 3)
+            h[i] += 1              # Bucket (nicht kumuliert; kumuliert wird beim Rendern)
+            h[-2] += seconds
+            h[-1] += 1
+
+    def inc(self, name: str, n: float) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def drain(self) -> Dict[str, Any]:
+        with self._lock:
+            snap = {"hist": self.hist, "counters": self.counters}
+            self.hist, self.counters = {}, {}
+        return snap
+
+    def merge(self, snap: Dict[str, Any]) -> None:
+        with self._lock:
+            for key, vals in snap["hist"].items():
+                h = self.hist.setdefault(key, [0.0] * len(vals))
+                for i, v in enumerate(vals):
+                    h[i] += v
+            for name, n in snap["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {k: list(v) for k, v in self.hist.items()}, dict(self.counters)
+
+REGISTRY = _Registry()
+
+def _record(name: str, seconds: float) -> None:
+    REGISTRY.observe("tables_stage_seconds", (("stage", name),), seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        t = timings.get(name)
+        if t is None:
+            timings[name] = [seconds, 1]
+        else:
+            t[0] += seconds
+            t[1] += 1
+
+@contextmanager
+def _stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - t0)
+
+_NOOP = nullcontext()
+
+def stage(name: str):
+    """ Kontextmanager: Dauer des Blocks als Stufe `name` messen. """
+    return _stage(name) if ENABLED else _NOOP
+
+def timed(name: str):
+    """ Dekorator: jede Ausführung der Funktion als Stufe `name` messen. """
+    def deco(fn):
+        if not ENABLED:
+            return fn
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+def count(name: str, n: float = 1) -> None:
+    """ Zähler tables_<name>_total erhöhen. """
+    if ENABLED and n:
+        REGISTRY.inc(name, n)
+
+def observe_request(route: str, method: str, seconds: float) -> None:
+    if ENABLED:
+        REGISTRY.observe("tables_http_request_seconds", (("method", method), ("route", route)), seconds)
+
+# -------- Prozessgrenzen (Ingestion im Worker) --------
+def drain() -> Optional[Dict[str, Any]]:
+    """ Bisherige Messwerte abgeben und zurücksetzen (im Worker am Jobende). """
+    return REGISTRY.drain() if ENABLED else None
+
+def merge(snap: Optional[Dict[str, Any]]) -> None:
+    """ Messwerte eines Workers übernehmen. """
+    if ENABLED and snap:
+        REGISTRY.merge(snap)
+
+# -------- Server-Timing --------
+def start_request() -> Any:
+    """ Sammeln der Stufen für einen Request beginnen; Rückgabe für end_request(). """
+    return _request_timings.set({}) if ENABLED else None
+
+def end_request(token: Any, total: float) -> Optional[str]:
+    """ Server-Timing-Headerwert ("stage;dur=ms;desc=...", ..., "total;dur=ms"). """
+    if token is None:
+        return None
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    parts = []
+    for name, (sec, n) in timings.items():
+        desc = f';desc="{n}x"' if n > 1 else ""
+        parts.append(f"{name};dur={sec * 1000:.2f}{desc}")
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+# -------- Prometheus-Textformat --------
+def _labels(labels: tuple, extra: str = "") -> str:
+    items = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+_HELP = {
+    "tables_stage_seconds": "Dauer je Verarbeitungsstufe",
+    "tables_http_request_seconds": "Dauer je HTTP-Route",
+}
+
+def render() -> str:
+    hist, counters = REGISTRY.snapshot()
+    out: List[str] = []
+    for metric in sorted({m for m, _ in hist}):
+        name = _metric_name(metric)
+        out.append(f"# HELP {name} {_HELP.get(metric, metric)}")
+        out.append(f"# TYPE {name} histogram")
+        for (m, labels), vals in sorted(hist.items()):
+            if m != metric:
+                continue
+            cum = 0.0
+            for b, v in zip(BUCKETS, vals):
+                cum += v
+                le = _labels(labels, 'le="%g"' % b)
+                out.append(f"{name}_bucket{le} {cum:g}")
+            le = _labels(labels, 'le="+Inf"')
+            out.append(f"{name}_bucket{le} {vals[-1]:g}")
+            out.append(f"{name}_sum{_labels(labels)} {vals[-2]:.6f}")
+            out.append(f"{name}_count{_labels(labels)} {vals[-1]:g}")
+    totals: Dict[str, float] = {}
+    for name, n in counters.items():
+        metric = _metric_name(f"tables_{name}_total")
+        totals[metric] = totals.get(metric, 0) + n
+    for metric, n in sorted(totals.items()):
+        out.append(f"# TYPE {metric} counter")
+        out.append(f"{metric} {n:g}")
+    return "\n".join(out) + "\n"
+
+def _metric_name(name: str) -> str:
+    """ Gültiger Prometheus-Name ([a-zA-Z_:][a-zA-Z0-9_:]*); ein falscher Zählername bricht sonst jeden Scrape. """
+    name = re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+    return name if re.match(r"[a-zA-Z_:]", name) else "_" + name
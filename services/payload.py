@@ -0,0 +1,49 @@
+# services/payload.py
+"""
+Vorab serialisierte, komprimierte JSON-Antworten (z.B. /tree).
+Einmal encodieren + komprimieren, danach nur noch Bytes ausliefern (ETag -> 304).
+"""
+from typing import Any, Optional
+from dataclasses import dataclass
+import gzip
+import hashlib
+import json
+
+from .metrics import timed
+
+try:  # optional: brotli (pip install brotli)
+    import brotli
+except ImportError:  # pragma: no cover - ohne brotli nur gzip
+    brotli = None
+
+@dataclass
+class JsonBlob:
+    etag: str                 # starker ETag inkl. Anführungszeichen
+    gzip: bytes               # gzip-komprimiertes JSON
+    br: Optional[bytes]       # brotli-komprimiert (falls verfügbar)
+    size: int                 # unkomprimierte Größe in Bytes
+
+    def raw(self) -> bytes:
+        """ Unkomprimiertes JSON (nur für Clients ohne gzip). """
+        return gzip.decompress(self.gzip)
+
+    def nbytes(self) -> int:
+        return len(self.gzip) + len(self.br or b"")
+
+@timed("payload.blob")
+def make_blob(obj: Any) -> JsonBlob:
+    raw = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = '"' + hashlib.blake2b(raw, digest_size=16).hexdigest() + '"'
+    return JsonBlob(
+        etag=etag,
+        gzip=gzip.compress(raw, compresslevel=6, mtime=0),
+        br=brotli.compress(raw, quality=5) if brotli is not None else None,
+        size=len(raw),
+    )
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    # schwache Vergleiche (W/"...") akzeptieren, "*" passt immer
+    return "*" in tags or any(t == etag or t == "W/" + etag for t in tags)
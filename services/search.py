@@ -1,8 +1,16 @@
 # services/search.py
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional, Iterator, Tuple
+from concurrent.futures import Executor, as_completed
+from array import array
 import re
+import threading
+import heapq
+from bisect import bisect_left
+import numpy as np
 import pandas as pd
 
+from .metrics import timed, count
+
 def _full_path_for_id(_id: str, parent_map: dict, label_map: dict) -> list[str]:
     parts = []
     cur = _id
@@ -45,3 +53,415 @@ def search_paths(
                 "path_parts": parts
             })
     return out
+
+# -------- Segment-Pool (pro Dataset) + Knoten-Index (pro Modell) --------
+_CACHE_MAX = 1024
+
+class SegmentPool:
+    """
+    Eindeutige normalisierte Segmente EINES Datasets (über alle Modelle geteilt).
+    - names/name_ids: internierte Originalnamen der Baumknoten, name_seg: Name-ID -> Segment-ID
+      (jeder Name wird pro Dataset nur einmal normalisiert, egal in wie vielen Modellen/Knoten)
+    - postings: Token -> Segment-IDs (für Wort-Substrings der Stripe-Suche)
+    - grams: Trigramm -> Segment-IDs (für Phrase-Substrings)
+    Ergebnisse je Wort/Phrase werden begrenzt gecacht, da /search sie pro Modell braucht.
+    Thread-sicher: Modelle werden lazy nachgebaut, während andere Requests suchen.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.ids: Dict[str, int] = {}
+        self.segs: List[str] = []
+        self.postings: Dict[str, List[int]] = {}
+        self.grams: Dict[str, List[int]] = {}
+        self.names: List[str] = []
+        self.name_ids: Dict[str, int] = {}
+        self.name_seg: List[int] = []
+        self._word_cache: Dict[str, frozenset] = {}
+        self._phrase_cache: Dict[str, frozenset] = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        for key in ("names", "name_seg"):
+            self.__dict__.setdefault(key, [])   # Pools aus älteren Cache-Dateien
+        self.__dict__.setdefault("name_ids", {})
+
+    def add(self, seg: str) -> int:
+        sid = self.ids.get(seg)
+        if sid is not None:
+            return sid
+        with self._lock:
+            return self._add_locked(seg)
+
+    def add_name(self, name: str, norm: Callable[[str], str]) -> int:
+        """ Originalnamen internieren -> Name-ID; normalisiert wird nur beim ersten Auftreten. """
+        nid = self.name_ids.get(name)
+        if nid is not None:
+            return nid
+        seg = norm(name)
+        with self._lock:
+            nid = self.name_ids.get(name)
+            if nid is None:
+                self.name_seg.append(self._add_locked(seg))
+                self.names.append(name)
+                nid = self.name_ids[name] = len(self.names) - 1
+            return nid
+
+    def _add_locked(self, seg: str) -> int:
+        sid = self.ids.get(seg)
+        if sid is not None:
+            return sid
+        sid = self.ids[seg] = len(self.segs)
+        self.segs.append(seg)
+        for tok in set(seg.split(" ")):
+            if tok:
+                self.postings.setdefault(tok, []).append(sid)
+        for g in {seg[i:i + 3] for i in range(len(seg) - 2)}:
+            self.grams.setdefault(g, []).append(sid)
+        self._word_cache.clear()
+        self._phrase_cache.clear()
+        return sid
+
+    @staticmethod
+    def _remember(cache: Dict[str, frozenset], key: str, val: frozenset) -> frozenset:
+        if len(cache) >= _CACHE_MAX:
+            cache.clear()
+        cache[key] = val
+        return val
+
+    def with_word(self, word: str) -> frozenset:
+        """ Segmente, die `word` (ohne Leerzeichen) als Substring enthalten. """
+        hit = self._word_cache.get(word)
+        if hit is not None:
+            return hit
+        with self._lock:
+            return self._word_locked(word)
+
+    def _word_locked(self, word: str) -> frozenset:
+        hit = self._word_cache.get(word)
+        if hit is not None:
+            return hit
+        # Wort ohne Leerzeichen -> Substring des Segments == Substring eines seiner Tokens
+        out: set = set()
+        for tok, sids in self.postings.items():
+            if word in tok:
+                out.update(sids)
+        return self._remember(self._word_cache, word, frozenset(out))
+
+    def with_phrase(self, phrase: str) -> frozenset:
+        """ Segmente, die `phrase` als Substring enthalten (Trigramm-Kandidaten + Prüfung). """
+        hit = self._phrase_cache.get(phrase)
+        if hit is not None:
+            return hit
+        with self._lock:
+            return self._remember(self._phrase_cache, phrase, self._find_phrase(phrase))
+
+    def _find_phrase(self, phrase: str) -> frozenset:
+        segs = self.segs
+        if len(phrase) < 3:
+            if phrase and " " not in phrase:
+                return self._word_locked(phrase)
+            return frozenset(i for i, sg in enumerate(segs) if phrase in sg)
+        lists = []
+        for g in {phrase[i:i + 3] for i in range(len(phrase) - 2)}:
+            lst = self.grams.get(g)
+            if not lst:
+                return frozenset()
+            lists.append(lst)
+        lists.sort(key=len)
+        cand = set(lists[0])
+        for lst in lists[1:]:
+            cand.intersection_update(lst)
+            if not cand:
+                break
+        return frozenset(i for i in cand if phrase in segs[i])
+
+def _child_key(parent: int, nid: int) -> int:
+    return (parent + 1) << 32 | nid
+
+@timed("search.node_index")
+def build_node_index(tree: Dict[str, Any], pool: SegmentPool, norm: Callable[[str], str]) -> Dict[str, Any]:
+    """
+    Knotentabelle eines Modells, Speicher ~ Knoten (nicht Knoten x Tiefe):
+    - Knoten = eindeutige Anker (Pfadpräfixe), in Preorder nummeriert
+    - parent/name/seg: Elternknoten, Namens-ID und Segment-ID im Pool (array("i"))
+    - child: (Elternknoten, Namens-ID) -> Knoten; löst Anker auf (node_for_anchor)
+    - seg_start/seg_order: Segment-ID -> Knoten dieses Modells (CSR, siehe seg_nodes)
+    - refs: Knoten -> erster Baumknoten (Preorder) mit diesem Anker
+    Anker und path_label entstehen erst für Treffer (anchor_of).
+    """
+    parent, name, seg = array("i"), array("i"), array("i")
+    child: Dict[int, int] = {}
+    refs: List[Dict[str, Any]] = []
+    name_ids, name_seg = pool.name_ids, pool.name_seg
+    visited = 0
+    stack = [(tree, -1)]
+    while stack:
+        node, p = stack.pop()
+        visited += 1
+        label = str(node.get("name","")).strip()
+        v = p  # Knoten ohne Namen hängen ihre Kinder an den Anker des Elternknotens
+        if label:
+            nid = name_ids.get(label)
+            if nid is None:
+                nid = pool.add_name(label, norm)
+            key = _child_key(p, nid)
+            v = child.get(key)
+            if v is None:
+                v = child[key] = len(refs)
+                parent.append(p)
+                name.append(nid)
+                seg.append(name_seg[nid])
+                refs.append(node)
+        stack.extend((ch, v) for ch in reversed(node.get("children") or []))
+    count("paths_indexed", visited)
+
+    segs = np.frombuffer(seg, dtype=np.intc) if len(seg) else np.zeros(0, dtype=np.intc)
+    order = np.argsort(segs, kind="stable")  # innerhalb eines Segments Preorder
+    start = np.zeros(int(segs.max(initial=-1)) + 2, dtype=np.intc)
+    np.cumsum(np.bincount(segs, minlength=len(start) - 1), out=start[1:])
+    return {"parent": parent, "name": name, "seg": seg, "child": child,
+            "seg_start": array("i", start.tobytes()), "seg_order": array("i", order.astype(np.intc).tobytes()),
+            "refs": refs, "pool": pool}
+
+def seg_nodes(nidx: Dict[str, Any], sid: int):
+    """ Knoten dieses Modells mit Segment `sid` (Preorder). """
+    start = nidx["seg_start"]
+    if sid + 1 >= len(start):
+        return ()
+    return nidx["seg_order"][start[sid]:start[sid + 1]]
+
+def anchor_of(nidx: Dict[str, Any], v: int) -> List[str]:
+    """ Anker (Originalnamen von der Wurzel bis v) über die Elternkette. """
+    names, name, parent = nidx["pool"].names, nidx["name"], nidx["parent"]
+    parts = []
+    while v >= 0:
+        parts.append(names[name[v]])
+        v = parent[v]
+    parts.reverse()
+    return parts
+
+def node_for_anchor(nidx: Dict[str, Any], anchor_parts: List[str]) -> Optional[int]:
+    """ Knoten-ID zu einem Anker (z.B. anchor_parts aus /search), None falls unbekannt. """
+    name_ids, child = nidx["pool"].name_ids, nidx["child"]
+    v = -1
+    for part in anchor_parts:
+        nid = name_ids.get(part)
+        v = None if nid is None else child.get(_child_key(v, nid))
+        if v is None:
+            return None
+    return v if anchor_parts else None
+
+@timed("search.collapse")
+def collapse_nodes(nidx: Dict[str, Any], nodes) -> List[int]:
+    """
+    Nur Knoten ohne Vorfahr unter den Treffern (die Elternkette ist der Präfix-Trie der Anker).
+    Aufwand ~ Treffer x Tiefe statt Treffer².
+    """
+    parent = nidx["parent"]
+    hit = set(nodes)
+    kept = []
+    for v in hit:
+        p = parent[v]
+        while p >= 0 and p not in hit:
+            p = parent[p]
+        if p < 0:
+            kept.append(v)
+    return kept
+
+def top_hits(nidx: Dict[str, Any], nodes, limit: int) -> List[Dict[str, Any]]:
+    """ Die ersten `limit` Treffer nach path_label; Anker/Dicts nur für Treffer bauen. """
+    labeled = [(" > ".join(a), a) for a in (anchor_of(nidx, v) for v in nodes)]  # Labels sind eindeutig
+    labeled = heapq.nsmallest(limit, labeled) if limit < len(labeled) else sorted(labeled)
+    return [{"anchor_parts": a, "path_label": label} for label, a in labeled]
+
+def search_models(models: List[str], get_index: Callable[[str], Dict[str, Any]], q_words: List[str],
+                  limit: int) -> List[Dict[str, Any]]:
+    """
+    /search über mehrere Modelle: Stripe-Suche (>= 2 Wörter), ohne Treffer Phrase-Suche.
+    Je Modell nur vorfahrenfreie Treffer; Ergebnis nach (Modell, path_label), höchstens `limit`.
+    Modelle werden in der gegebenen Reihenfolge abgearbeitet, bis `limit` Treffer feststehen;
+    get_index(model) -> Knotentabelle wird erst dann aufgerufen (lazy gebaute Indizes).
+    """
+    def collect(match_nodes) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = []
+        for m in models:
+            nidx = get_index(m)
+            hits = top_hits(nidx, collapse_nodes(nidx, match_nodes(nidx)), limit - len(results))
+            results.extend({"model": m, **h} for h in hits)
+            if len(results) >= limit:
+                break
+        return results
+
+    if len(q_words) >= 2:
+        results = collect(lambda nidx: stripe_nodes(nidx, q_words))
+        if results:
+            return results
+    phrase = " ".join(q_words)
+    return collect(lambda nidx: phrase_nodes(nidx, phrase))
+
+def search_batch(executor: Executor, models: List[str], get_index: Callable[[str], Dict[str, Any]],
+                 queries: List[List[str]], limit: int) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+    """
+    Viele (bereits tokenisierte) Queries auf dem Executor -> (Position, Treffer) in Fertig-Reihenfolge.
+    Gleiche Queries werden nur einmal gesucht. Bricht der Verbraucher ab, werden offene Queries verworfen.
+    """
+    positions: Dict[tuple, List[int]] = {}
+    for i, q_words in enumerate(queries):
+        positions.setdefault(tuple(q_words), []).append(i)
+    futures = {executor.submit(search_models, models, get_index, list(q), limit): pos
+               for q, pos in positions.items()}
+    try:
+        for fut in as_completed(futures):
+            hits = fut.result()
+            for i in futures[fut]:
+                yield i, hits
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+@timed("search.stripe")
+def stripe_nodes(nidx: Dict[str, Any], q_words: List[str]) -> List[int]:
+    """
+    Knoten-IDs der Stripe-Treffer (ohne Sortierung): Kandidaten-Segmente je Query-Teilphrase
+    aus den Postings, danach nur noch die Reihenfolge der Segmente entlang der Elternkette prüfen.
+    """
+    n = len(q_words)
+    if n < 2:
+        return []
+    pool: SegmentPool = nidx["pool"]
+    segs, seg, parent = pool.segs, nidx["seg"], nidx["parent"]
+
+    word_segs = [pool.with_word(w) for w in q_words]
+    # ph[(a, b)] = Segmente, die die Phrase q_words[a:b] enthalten
+    ph: Dict[tuple, set] = {}
+    for a in range(n):
+        cand = None
+        for b in range(a + 1, n + 1):
+            cand = word_segs[b - 1] if cand is None else cand & word_segs[b - 1]
+            if not cand:
+                break
+            phrase = " ".join(q_words[a:b])
+            ph[(a, b)] = {s for s in cand if phrase in segs[s]}
+
+    empty: set = set()
+    memo: Dict[tuple, bool] = {}
+
+    def reach(v: int, k: int) -> bool:
+        # q_words[0:k] lässt sich in >=1 Gruppen zerlegen, deren letzte genau in Knoten v liegt
+        if v < 0:
+            return False
+        key = (v, k)
+        r = memo.get(key)
+        if r is None:
+            s = seg[v]
+            r = s in ph.get((0, k), empty) or any(
+                s in ph.get((a, k), empty) and reach(parent[v], a) for a in range(1, k)
+            )
+            memo[key] = r
+        return r
+
+    found = []
+    final_segs = set().union(*(ph.get((a, n), empty) for a in range(1, n)))
+    scanned = 0
+    for s in final_segs:
+        cand = seg_nodes(nidx, s)
+        scanned += len(cand)
+        for v in cand:
+            if any(s in ph.get((a, n), empty) and reach(parent[v], a) for a in range(1, n)):
+                found.append(v)
+    count("hits_scanned", scanned)
+    return found
+
+@timed("search.phrase")
+def phrase_nodes(nidx: Dict[str, Any], phrase: str) -> List[int]:
+    """
+    Knoten-IDs der Phrase-Treffer (schon vorfahrenfrei, ohne Sortierung): Anker = erster Knoten eines
+    Pfades, dessen Segment die Phrase enthält. Aufwand ~ Anzahl Treffer (Pool-Abfrage ist pro Dataset gecacht).
+    """
+    hit_segs = nidx["pool"].with_phrase(phrase)
+    seg, parent = nidx["seg"], nidx["parent"]
+    found = []
+    scanned = 0
+    for s in hit_segs:
+        cand = seg_nodes(nidx, s)
+        scanned += len(cand)
+        for v in cand:
+            p = parent[v]
+            while p >= 0 and seg[p] not in hit_segs:
+                p = parent[p]
+            if p < 0:  # kein Vorfahr trifft -> v ist der Anker
+                found.append(v)
+    count("hits_scanned", scanned)
+    return found
+
+# -------- Präfix-Index (Typeahead /suggest) --------
+class PrefixIndex:
+    """
+    Sortierte Präfix-Listen über die Segmente eines SegmentPools.
+    - starts: ganze Segmente (Segmentanfang)
+    - inner: Segment ab jedem weiteren Wortanfang ("low beam" -> "beam")
+    Abfrage = bisect auf den Präfixbereich; Segmentanfänge werden zuerst geliefert.
+    """
+    def __init__(self, pool: SegmentPool) -> None:
+        with pool._lock:
+            segs = list(pool.segs)
+        self.n_segs = len(segs)
+        starts, inner = [], []
+        for sid, seg in enumerate(segs):
+            if not seg:
+                continue
+            starts.append((seg, sid))
+            i = seg.find(" ")
+            while i >= 0:
+                inner.append((seg[i + 1:], sid))
+                i = seg.find(" ", i + 1)
+        starts.sort()
+        inner.sort()
+        self.starts = starts
+        self.inner = inner
+
+    @staticmethod
+    def _range(entries: List[tuple], prefix: str):
+        lo = bisect_left(entries, (prefix,))
+        hi = bisect_left(entries, (prefix + "\U0010ffff",))
+        return entries[lo:hi] if hi - lo <= _SCAN_MAX else entries[lo:lo + _SCAN_MAX]
+
+    def segments(self, prefix: str):
+        """ Segment-IDs mit passendem Präfix, ohne Duplikate (Segmentanfänge zuerst). """
+        seen = set()
+        for entries in (self.starts, self.inner):
+            for _, sid in self._range(entries, prefix):
+                if sid not in seen:
+                    seen.add(sid)
+                    yield sid
+
+_SCAN_MAX = 5000   # max. Einträge je Präfixbereich (sehr kurze Präfixe)
+
+def suggest_completions(pidx: PrefixIndex, model_indexes: Dict[str, Dict[str, Any]], prefix: str, k: int = 10) -> List[Dict[str, Any]]:
+    """
+    Top-k Vervollständigungen für `prefix` (normalisiert):
+      { "model", "name", "anchor_parts", "path_label" }
+    Reihenfolge: Segmentanfang vor Wortanfang, dann lexikografisch, dann flachere Anker.
+    """
+    out: List[Dict[str, Any]] = []
+    if k <= 0:
+        return out
+    for sid in pidx.segments(prefix):
+        cands = []
+        for m, nidx in model_indexes.items():
+            for v in seg_nodes(nidx, sid)[:k]:
+                anchor = anchor_of(nidx, v)
+                cands.append((len(anchor), m, anchor))
+        cands.sort(key=lambda c: (c[0], c[1]))
+        for _, m, anchor in cands:
+            out.append({"model": m, "name": anchor[-1], "anchor_parts": anchor,
+                        "path_label": " > ".join(anchor)})
+            if len(out) >= k:
+                return out
+    return out
@@ -1,28 +1,671 @@
 # services/store.py
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Iterable, Iterator, List
 from uuid import uuid4
 from dataclasses import dataclass, field
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import sys
+import json
+import mmap
+import pickle
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+_COMPARE_CACHE_MAX = 32
+_SUGGEST_CACHE_MAX = 256
+_PATCH_LEASE_SECONDS = 300  # PATCH-Sperre im Katalog verfällt danach (abgestürzter Worker)
+
+class PatchConflict(Exception):
+    """ PATCH verworfen: die Bundle-Datei wurde inzwischen von einem anderen Worker neu geschrieben. """
+    pass
 
 @dataclass
 class DataBundle:
     frames: Dict[str, Any]
     meta: Dict[str, Any] = field(default_factory=dict)
-    trees: Dict[str, Any] = field(default_factory=dict)   # pruned trees per model
-    index: Dict[str, Any] = field(default_factory=dict)   # paths/npaths per model
+    trees: Dict[str, Any] = field(default_factory=dict)   # pruned trees per model (lazy)
+    index: Dict[str, Any] = field(default_factory=dict)   # paths/npaths per model (lazy)
+    hier: Any = None                                      # RowHierarchy (einmal pro Upload)
+    pool: Any = None                                      # SegmentPool (geteilt über Modelle)
+    rollup: Any = None                                    # builder.Rollup (Treemap-Roll-ups aller Modelle)
+    coverage: Any = None                                  # coverage.Coverage (Modell-Bitsets je Knoten des Roll-ups)
+    blobs: Dict[str, Any] = field(default_factory=dict)   # vorab serialisierte Bäume (JsonBlob) je Modell
+    node_counts: Dict[str, int] = field(default_factory=dict)  # Knotenanzahl je Modellbaum
+    compare_cache: Any = field(default_factory=OrderedDict)  # (Modelle, Baseline, Abschnitt) -> Vergleich
+    prefix_index: Any = None                              # search.PrefixIndex über den SegmentPool
+    suggest_cache: Any = field(default_factory=OrderedDict)  # (Präfix, Modell, k) -> Vorschläge
+    grown_bytes: int = 0                                  # Größe lazy nachgebauter Bäume/Indizes
+    _lock: Any = field(default_factory=threading.RLock, repr=False, compare=False)
+    _unsized: List[Any] = field(default_factory=list, repr=False, compare=False)  # noch nicht vermessen
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_unsized"] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def grown(self) -> int:
+        """ grown_bytes inkl. noch ausstehender Größenschätzungen (nur bei Bedarf, z.B. mit Budget). """
+        with self._lock:
+            pending, self._unsized = self._unsized, []
+        for obj in pending:
+            self.grown_bytes += _approx_size(obj)
+        return self.grown_bytes
+
+    def clone(self) -> "DataBundle":
+        """ Flache Kopie für Änderungen (PATCH), ohne ein mit anderen dataset_ids geteiltes Bundle anzufassen. """
+        with self._lock:
+            meta = {k: (v.copy() if isinstance(v, (dict, list)) else v) for k, v in self.meta.items()}
+            return DataBundle(
+                frames=dict(self.frames), meta=meta, trees=dict(self.trees), index=dict(self.index),
+                hier=self.hier, pool=self.pool, rollup=self.rollup, coverage=self.coverage, blobs=dict(self.blobs),
+                node_counts=dict(self.node_counts), prefix_index=self.prefix_index,
+            )
+
+    def build_state(self) -> tuple:
+        """ Was bisher (lazy) gebaut wurde -> geändert = Cache-Datei veraltet. """
+        return (len(self.trees), len(self.index), self.rollup is not None, len(self.blobs))
+
+    def forget_growth(self) -> None:
+        """ Ausstehende Schätzungen verwerfen (das ganze Bundle wurde gerade vermessen). """
+        with self._lock:
+            self._unsized = []
+
+    def models(self) -> List[str]:
+        return list(self.meta.get("model_cols") or [c for c in self.trees])
+
+    def get_rollup(self):
+        """ Vorberechnete Treemap-Roll-ups (beim Upload gebaut, sonst beim ersten Zugriff). """
+        if self.rollup is not None:
+            return self.rollup
+        with self._lock:
+            if self.rollup is None:
+                from .builder import build_rollup
+                self.rollup = build_rollup(self.frames["main"], self.meta)
+                self._unsized.append(self.rollup)
+            return self.rollup
+
+    def get_coverage(self):
+        """ Modell-Bitsets je Knoten, beim ersten Zugriff aus dem Roll-up gebaut. """
+        if self.coverage is not None:
+            return self.coverage
+        rollup = self.get_rollup()
+        with self._lock:
+            if self.coverage is None:
+                from .coverage import build_coverage
+                self.coverage = build_coverage(rollup)
+                self._unsized.append(self.coverage)
+            return self.coverage
+
+    def compare(self, models: List[str], baseline: Optional[str] = None, section: Optional[str] = None):
+        """ N-Wege-Vergleich, gecacht je (Modellmenge, Baseline, Abschnitt). """
+        key = (tuple(models), (baseline or models[0]) if models else None, section or None)
+        with self._lock:
+            hit = self.compare_cache.get(key)
+            if hit is not None:
+                self.compare_cache.move_to_end(key)
+                return hit
+        from .compare import compare_models
+        res = compare_models(self.get_rollup(), list(models), baseline, section)
+        with self._lock:
+            self.compare_cache[key] = res
+            while len(self.compare_cache) > _COMPARE_CACHE_MAX:
+                self.compare_cache.popitem(last=False)
+        return res
+
+    def suggest(self, prefix: str, k: int = 10, model: Optional[str] = None) -> List[Dict[str, Any]]:
+        """ Typeahead über alle (bzw. ein) Modelle; Präfix-Index + begrenzter LRU-Cache. """
+        from .search import PrefixIndex, suggest_completions
+        models = [model] if model else self.models()
+        indexes = {m: self.model_index(m)["nodes"] for m in models if m in self.models()}
+        if not indexes or self.pool is None:
+            return []
+        key = (prefix, model, k)
+        with self._lock:
+            # Pool wächst, wenn Modelle lazy indexiert werden -> Präfix-Index neu aufbauen
+            if self.prefix_index is None or self.prefix_index.n_segs != len(self.pool.segs):
+                self.prefix_index = PrefixIndex(self.pool)
+                self.suggest_cache.clear()
+            pidx = self.prefix_index
+            hit = self.suggest_cache.get(key)
+            if hit is not None:
+                self.suggest_cache.move_to_end(key)
+                return hit
+        res = suggest_completions(pidx, indexes, prefix, k)
+        with self._lock:
+            if pidx is self.prefix_index:
+                self.suggest_cache[key] = res
+                while len(self.suggest_cache) > _SUGGEST_CACHE_MAX:
+                    self.suggest_cache.popitem(last=False)
+        return res
+
+    def tree(self, model: str) -> Optional[Dict[str, Any]]:
+        """ Geprunter Baum eines Modells; wird beim ersten Zugriff gebaut und gecacht. """
+        t = self.trees.get(model)
+        if t is not None or self.hier is None or model not in self.models():
+            return t
+        with self._lock:
+            t = self.trees.get(model)
+            if t is None:
+                from .tree import build_pruned_tree
+                t = build_pruned_tree(self.hier, self.frames["main"][model])
+                self.trees[model] = t
+                self._unsized.append(t)
+            return t
+
+    def tree_node_count(self, model: str) -> Optional[int]:
+        n = self.node_counts.get(model)
+        if n is None:
+            t = self.tree(model)
+            if t is None:
+                return None
+            from .tree import count_nodes
+            n = self.node_counts[model] = count_nodes(t)
+        return n
+
+    def tree_blob(self, model: str):
+        """ Baum eines Modells als einmal serialisiertes, komprimiertes JSON (JsonBlob). """
+        blob = self.blobs.get(model)
+        if blob is not None:
+            return blob
+        t = self.tree(model)
+        if t is None:
+            return None
+        with self._lock:
+            blob = self.blobs.get(model)
+            if blob is None:
+                from .payload import make_blob
+                blob = make_blob(t)
+                self.blobs[model] = blob
+                self.grown_bytes += blob.nbytes()
+            return blob
+
+    def tree_node(self, model: str, anchor_parts: List[str]) -> Optional[Dict[str, Any]]:
+        """ Baumknoten zu einem Anker (anchor_parts aus /search) über den Pfad-Index. """
+        idx = self.model_index(model)
+        if idx is None:
+            return None
+        from .search import node_for_anchor
+        v = node_for_anchor(idx["nodes"], anchor_parts)
+        return None if v is None else idx["nodes"]["refs"][v]
+
+    def model_index(self, model: str) -> Optional[Dict[str, Any]]:
+        """ Suchindex (Knotentabelle) eines Modells; lazy wie tree(). """
+        idx = self.index.get(model)
+        if idx is not None and "paths" in idx:
+            idx = None  # altes Format (Pfadlisten) aus einer Cache-Datei -> neu bauen
+        if idx is not None or self.hier is None or model not in self.models():
+            return idx
+        with self._lock:
+            idx = self.index.get(model)
+            if idx is None or "paths" in idx:
+                from .tree import build_model_index
+                idx = build_model_index(self.tree(model), self.pool)
+                self.index[model] = idx
+                # refs zeigen in den Baum, pool ist geteilt -> nicht doppelt zählen
+                self._unsized.append({k: v for k, v in idx["nodes"].items() if k not in ("refs", "pool")})
+            return idx
+
+def _approx_size(obj: Any, seen: Optional[set] = None) -> int:
+    """
+    Grobe Speichergröße (Bytes) eines Bundles: DataFrames/Arrays über ihre Puffer,
+    Container rekursiv. Geteilte Objekte (z.B. SegmentPool) zählen nur einmal.
+    """
+    if seen is None:
+        seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        if isinstance(o, pd.DataFrame):
+            total += int(o.memory_usage(index=True, deep=True).sum())
+        elif isinstance(o, pd.Series):
+            total += int(o.memory_usage(index=True, deep=True))
+        elif isinstance(o, np.ndarray):
+            total += o.nbytes
+        elif isinstance(o, dict):
+            total += sys.getsizeof(o)
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            total += sys.getsizeof(o)
+            stack.extend(o)
+        elif hasattr(o, "__dict__"):
+            total += sys.getsizeof(o)
+            stack.append(vars(o))
+        else:
+            total += sys.getsizeof(o)
+    return total
+
+# -------- Bundle-Dateien (Auslagerung + persistenter Cache) --------
+# Layout: Magic | Header-Länge | JSON-Header {"pickle": [off, len], "buffers": [[off, len], ...]} | Daten.
+# Große numpy-Puffer (DataFrame-Spalten, Roll-up-Matrizen) liegen out-of-band (Pickle-Protokoll 5),
+# 64-Byte-ausgerichtet, und werden beim Laden per mmap eingeblendet statt kopiert.
+_MAGIC = b"TBLSBND1"
+_ALIGN = 64
+
+def _write_bundle(bundle: DataBundle, path: str) -> None:
+    os.replace(_write_bundle_tmp(bundle, path), path)
+
+def _write_bundle_tmp(bundle: DataBundle, path: str) -> str:
+    """ Bundle neben `path` in eine Temp-Datei schreiben -> deren Pfad (os.replace macht der Aufrufer). """
+    buffers: List[pickle.PickleBuffer] = []
+    with bundle._lock:
+        payload = pickle.dumps(bundle, protocol=5, buffer_callback=buffers.append)
+    raws = [b.raw() for b in buffers]
+    sizes = [len(payload)] + [r.nbytes for r in raws]
+    # Header-Länge hängt von den Offsets ab -> mit großzügiger Reserve rechnen
+    head_len = 64 + 48 * len(sizes)
+    offsets, pos = [], len(_MAGIC) + 8 + head_len
+    for n in sizes:
+        pos = -(-pos // _ALIGN) * _ALIGN
+        offsets.append(pos)
+        pos += n
+    header = json.dumps({"pickle": [offsets[0], sizes[0]],
+                         "buffers": [[o, n] for o, n in zip(offsets[1:], sizes[1:])]}).encode()
+    assert len(header) <= head_len
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"  # eindeutig über Worker-/Pool-Prozesse hinweg
+    with open(tmp, "wb") as f:
+        f.write(_MAGIC + struct.pack("<Q", head_len) + header.ljust(head_len))
+        for off, chunk in zip(offsets, [payload] + raws):
+            f.seek(off)
+            f.write(chunk)
+    return tmp
+
+def _read_bundle(path: str) -> DataBundle:
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{path}: keine Bundle-Datei")
+        head_len, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(head_len))
+        # ACCESS_COPY: Seiten kommen lazy von der Platte, Schreibzugriffe bleiben privat
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    view = memoryview(mm)
+    off, n = header["pickle"]
+    return pickle.loads(view[off:off + n], buffers=[view[o:o + k] for o, k in header["buffers"]])
 
 class InMemoryStore:
-    def __init__(self) -> None:
-        self._data: Dict[str, DataBundle] = {}
+    """
+    Dataset-Speicher mit optionalem Speicherbudget.
+    - max_bytes=None: alles bleibt resident (altes Verhalten)
+    - sonst LRU: zuletzt ungenutzte Bundles werden nach spill_dir (bzw. in den cache_dir) ausgelagert
+      und beim nächsten get() transparent wieder geladen.
+    Jede dataset_id ist ein Alias auf ein Bundle. Identische Uploads (gleicher Digest)
+    teilen sich ein Bundle; es wird erst verworfen, wenn alle Aliase freigegeben sind.
+    - cache_dir: Bundles liegen als Dateien im Ordner, dataset_ids/Digests im SQLite-Katalog
+      (catalog.Catalog) daneben. Das überlebt Neustarts und wird von allen Workern eines Hosts
+      geteilt: jeder Worker löst jede dataset_id über den Katalog auf und blendet das Bundle beim
+      ersten get() per mmap ein. Ändert ein anderer Worker das Bundle (PATCH), wird es neu geladen.
+      Jede Bundle-Datei hat eine Version im Katalog; geschrieben wird nur per Compare-and-Swap auf die
+      zuletzt gelesene Version, PATCHes eines Bundles laufen über eine Katalog-Sperre nacheinander.
+    """
+    def __init__(self, max_bytes: Optional[int] = None, spill_dir: Optional[str] = None,
+                 cache_dir: Optional[str] = None) -> None:
+        self._data: "OrderedDict[str, DataBundle]" = OrderedDict()   # resident, LRU-Reihenfolge
+        self._sizes: Dict[str, int] = {}
+        self._grown0: Dict[str, int] = {}                             # grown_bytes beim Einlagern
+        self._spilled: Dict[str, str] = {}                            # Bundle-Key -> Datei
+        self._alias: Dict[str, str] = {}                              # dataset_id -> Bundle-Key
+        self._refs: Dict[str, int] = {}                               # Bundle-Key -> Anzahl Aliase
+        self._digests: Dict[str, str] = {}                            # Inhalts-Digest -> Bundle-Key
+        self._lock = threading.RLock()
+        self._patch_lock = threading.Lock()                           # PATCHes ohne Katalog nacheinander
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "dedup_hits": 0, "reloads": 0}
+        self.cache_dir = cache_dir
+        self.catalog = None
+        self._persisted: Dict[str, tuple] = {}                        # Bundle-Key -> build_state() der Cache-Datei
+        self._versions: Dict[str, int] = {}                           # Bundle-Key -> Katalog-Version der geladenen Datei
+        if cache_dir:
+            from .catalog import Catalog
+            os.makedirs(cache_dir, exist_ok=True)
+            self.catalog = Catalog(os.path.join(cache_dir, "catalog.sqlite"))
 
-    def create(self, frames: Dict[str, Any], meta: Dict[str, Any], trees=None, index=None) -> str:
-        ds_id = uuid4().hex
-        self._data[ds_id] = DataBundle(frames=frames, meta=meta, trees=trees or {}, index=index or {})
+    def create(self, frames: Dict[str, Any], meta: Dict[str, Any], trees=None, index=None,
+               digests: Iterable[str] = (), hier=None, pool=None, rollup=None) -> str:
+        key = uuid4().hex
+        digests = list(digests)
+        bundle = DataBundle(frames=frames, meta=meta, trees=trees or {}, index=index or {},
+                            hier=hier, pool=pool, rollup=rollup)
+        with self._lock:
+            self._refs[key] = 0
+            for d in digests:
+                self._digests[d] = key
+            self._admit(key, bundle)
+            ds_id = self._new_alias(key)
+        if self.catalog is not None:
+            # erst die Datei, dann der Katalog -> andere Worker sehen nur vollständige Bundles
+            self._persist(key, bundle)  # Schreiben außerhalb des Store-Locks
+            self.catalog.add_bundle(key, ds_id, digests)
         return ds_id
 
+    def attach(self, digest: str) -> Optional[str]:
+        """ Neue dataset_id für ein bereits gebautes Bundle mit diesem Digest (sonst None). """
+        with self._lock:
+            if self.catalog is not None:
+                key = self.catalog.digest_key(digest)
+                ds_id = uuid4().hex
+                if key is None or not self.catalog.add_alias(ds_id, key):
+                    return None
+                self._remember_alias(ds_id, key)
+            else:
+                key = self._digests.get(digest)
+                if key is None:
+                    return None
+                ds_id = self._new_alias(key)
+            self._stats["dedup_hits"] += 1
+            return ds_id
+
+    def link_digest(self, ds_id: str, digest: str) -> None:
+        """ Weiteren Digest (z.B. Rohbytes zusätzlich zum DataFrame-Hash) auf dasselbe Bundle zeigen lassen. """
+        with self._lock:
+            key = self._digests[digest] = self._resolve(ds_id)
+            if self.catalog is not None:
+                self.catalog.add_digest(digest, key)
+
+    def patch(self, ds_id: str, columns=None, rows=None) -> Dict[str, Any]:
+        """
+        Ändert das Dataset hinter ds_id inkrementell (siehe update.apply_patch); die dataset_id bleibt.
+        Geändert wird immer eine Kopie; sie ersetzt das Bundle erst, wenn sie geschrieben ist.
+        Teilt sich ds_id das Bundle mit anderen dataset_ids, bekommt ds_id die Kopie als eigenes Bundle.
+        PatchConflict, falls ein anderer Worker die Bundle-Datei inzwischen geändert hat.
+        """
+        with self._patch_lease(ds_id):
+            return self._patch(ds_id, columns, rows)
+
+    @contextmanager
+    def _patch_lease(self, ds_id: str) -> Iterator[None]:
+        """
+        Mit Katalog: PATCHes eines Bundles laufen über alle Worker nacheinander (Sperre im Katalog,
+        jeweils kurz per BEGIN IMMEDIATE gesetzt statt die Schreibtransaktion über den ganzen PATCH zu halten).
+        Ohne Katalog: ein Lock im Prozess.
+        """
+        if self.catalog is None:
+            with self._patch_lock:
+                yield
+            return
+        owner = f"{os.getpid()}.{threading.get_ident()}.{uuid4().hex}"
+        while True:
+            key = self._resolve_locked(ds_id)
+            if self.catalog.acquire_lease(key, owner, _PATCH_LEASE_SECONDS):
+                if self._resolve_locked(ds_id) == key:
+                    break
+                self.catalog.release_lease(key, owner)  # Alias inzwischen auf eine Kopie umgezogen
+                continue
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            self.catalog.release_lease(key, owner)
+
+    def _resolve_locked(self, ds_id: str) -> str:
+        with self._lock:
+            return self._resolve(ds_id)
+
+    def _patch(self, ds_id: str, columns=None, rows=None) -> Dict[str, Any]:
+        from .update import apply_patch
+        with self._lock:
+            bundle = self.get(ds_id)  # lädt neu, falls ein anderer Worker das Bundle geändert hat
+            key = self._alias[ds_id]
+            n_alias = self.catalog.alias_count(key) if self.catalog is not None else self._refs[key]
+        shared = n_alias > 1
+        # Änderung immer an einer Kopie: ungültige Änderungen (ValueError) oder ein Konflikt beim Schreiben
+        # lassen Bundle, Cache-Datei, Digests und Aliase unberührt; die Kopie wird dann einfach verworfen.
+        target = bundle.clone()
+        result = apply_patch(target, columns, rows)
+
+        new_key = uuid4().hex if shared else key
+        if shared:
+            with self._lock:
+                self._refs[new_key] = 0
+        if self.catalog is not None:
+            if not self._persist(new_key, target):
+                if shared:
+                    with self._lock:
+                        self._refs.pop(new_key, None)
+                raise PatchConflict(f"Dataset {ds_id} wurde gleichzeitig von einem anderen Worker geändert.")
+            if shared:
+                self.catalog.move_alias(ds_id, new_key)
+        with self._lock:
+            if shared:
+                self._refs[key] -= 1
+                self._refs[new_key] += 1
+                self._alias[ds_id] = new_key
+            else:
+                # Inhalt passt nicht mehr zu den Upload-Digests -> keine Dedup-Treffer mehr
+                for d in [d for d, k in self._digests.items() if k == key]:
+                    del self._digests[d]
+                if self.catalog is not None:
+                    self.catalog.drop_digests(key)
+            self._admit(new_key, target)  # ersetzt das alte Bundle bzw. lagert die Kopie ein
+        return result
+
+    def release(self, ds_id: str) -> None:
+        """ Gibt eine dataset_id frei; das Bundle verschwindet mit dem letzten Alias. """
+        with self._lock:
+            if self.catalog is not None:
+                key, left = self.catalog.release(ds_id)
+                if key is None:
+                    raise KeyError(ds_id)
+                self._alias.pop(ds_id, None)
+                self._refs[key] = left
+            else:
+                key = self._alias.pop(ds_id)
+                self._refs[key] -= 1
+                left = self._refs[key]
+            if left > 0:
+                return
+            del self._refs[key]
+            self._data.pop(key, None)
+            self._sizes.pop(key, None)
+            self._grown0.pop(key, None)
+            self._persisted.pop(key, None)
+            self._versions.pop(key, None)
+            path = self._spilled.pop(key, None)
+            paths = [path] + ([self._cache_path(key)] if self.cache_dir else [])
+            for p in paths:
+                if p and os.path.exists(p):
+                    os.remove(p)  # andere Worker behalten ihr mmap bis zum nächsten Auflösen
+            for d in [d for d, k in self._digests.items() if k == key]:
+                del self._digests[d]
+
     def get(self, ds_id: str) -> DataBundle:
-        return self._data[ds_id]
+        with self._lock:
+            key = self._resolve(ds_id)
+            bundle = self._data.get(key)
+            if bundle is not None and self._stale(key):
+                # von einem anderen Worker neu geschrieben (z.B. PATCH) -> neu laden
+                self._stats["reloads"] += 1
+                self._drop_resident(key)
+                bundle = None
+            if bundle is not None:
+                self._stats["hits"] += 1
+                self._data.move_to_end(key)
+                # Bundles wachsen durch lazy gebaute Modelle -> Budget erneut prüfen
+                self._enforce_budget(keep=key)
+                return bundle
+            path = self._spilled[key]
+            self._stats["misses"] += 1
+            # Version vor dem Lesen: schreibt ein anderer Worker dazwischen, gilt die Kopie als veraltet
+            version = self.catalog.bundle_version(key) if self.catalog is not None else None
+            bundle = _read_bundle(path)
+            if self.cache_dir:
+                self._persisted[key] = bundle.build_state()
+                self._versions[key] = version
+            self._admit(key, bundle)
+            return bundle
 
     def has(self, ds_id: str) -> bool:
-        return ds_id in self._data
+        with self._lock:
+            try:
+                self._resolve(ds_id)
+                return True
+            except KeyError:
+                return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            for k, b in self._data.items():
+                if k not in self._sizes:
+                    b.forget_growth()
+                    self._grown0[k] = b.grown_bytes
+                    self._sizes[k] = _approx_size(b)
+            datasets, bundles = self.catalog.counts() if self.catalog is not None else (len(self._alias), len(self._refs))
+            return {
+                **self._stats,
+                "datasets": datasets,
+                "bundles": bundles,
+                "resident": len(self._data),
+                "resident_bytes": self._resident_bytes(),
+                "spilled": sum(1 for k in self._spilled if k not in self._data),
+                "persisted": len(self._persisted),
+                "max_bytes": self.max_bytes,
+                "pid": os.getpid(),
+            }
+
+    def flush(self) -> None:
+        """ Seit dem letzten Schreiben gewachsene Bundles (lazy Bäume/Indizes) in den Cache schreiben. """
+        if not self.cache_dir:
+            return
+        with self._lock:
+            grown = [(k, b) for k, b in self._data.items() if self._persisted.get(k) != b.build_state()]
+        for key, bundle in grown:
+            self._persist(key, bundle)  # veraltet (anderer Worker hat geschrieben) -> bleibt ungeschrieben
+
+    # ---------- intern ----------
+    def _new_alias(self, key: str) -> str:
+        ds_id = uuid4().hex
+        self._alias[ds_id] = key
+        self._refs[key] += 1
+        return ds_id
+
+    def _resolve(self, ds_id: str) -> str:
+        """ dataset_id -> Bundle-Key; mit Katalog immer dort nachsehen (andere Worker). KeyError, falls unbekannt. """
+        if self.catalog is None:
+            return self._alias[ds_id]
+        key = self.catalog.alias_key(ds_id)
+        if key is None:
+            self._alias.pop(ds_id, None)
+            raise KeyError(ds_id)
+        if self._alias.get(ds_id) != key:
+            self._remember_alias(ds_id, key)
+        return key
+
+    def _remember_alias(self, ds_id: str, key: str) -> None:
+        self._alias[ds_id] = key
+        self._refs[key] = self._refs.get(key, 0) + 1
+        if key not in self._data:
+            self._spilled[key] = self._cache_path(key)
+
+    def _stale(self, key: str) -> bool:
+        if self.catalog is None or key not in self._versions:
+            return False
+        return self.catalog.bundle_version(key) != self._versions[key]
+
+    def _drop_resident(self, key: str) -> None:
+        self._data.pop(key, None)
+        self._sizes.pop(key, None)
+        self._grown0.pop(key, None)
+        self._spilled[key] = self._cache_path(key)
+
+    def _admit(self, key: str, bundle: DataBundle) -> None:
+        self._data[key] = bundle
+        self._data.move_to_end(key)
+        self._sizes.pop(key, None)
+        bundle.forget_growth()
+        self._grown0[key] = bundle.grown_bytes
+        if self.max_bytes is not None:
+            # Größenschätzung kostet ~ einen Baum-Durchlauf -> nur mit Budget sofort
+            self._sizes[key] = _approx_size(bundle)
+            self._enforce_budget(keep=key)
+
+    def _resident_bytes(self) -> int:
+        return sum(n + self._data[k].grown() - self._grown0.get(k, 0) for k, n in self._sizes.items())
+
+    def _enforce_budget(self, keep: str) -> None:
+        if self.max_bytes is None:
+            return
+        while self._resident_bytes() > self.max_bytes:
+            victim = next((k for k in self._data if k != keep), None)
+            if victim is None:
+                break  # einzelnes Bundle größer als Budget -> bleibt trotzdem resident
+            self._spill(victim)
+
+    def _spill(self, key: str) -> None:
+        bundle = self._data[key]
+        if self.cache_dir:
+            # Cache-Datei dient als Auslagerung; nur neu schreiben, wenn seither etwas gebaut wurde.
+            # Ist sie inzwischen neuer (anderer Worker), verwerfen wir die lokale Kopie und laden sie neu.
+            if self._persisted.get(key) != bundle.build_state():
+                self._persist(key, bundle)
+            path = self._cache_path(key)
+        else:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="tables_store_")
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = os.path.join(self.spill_dir, f"{key}.bundle")
+            # Bundles können nach dem Upload ergänzt werden -> bei jeder Auslagerung neu schreiben
+            _write_bundle(bundle, path)
+        self._spilled[key] = path
+        del self._data[key]
+        self._sizes.pop(key, None)
+        self._grown0.pop(key, None)
+        self._stats["evictions"] += 1
+
+    # ---------- persistenter Cache ----------
+    def _cache_path(self, key: str, ext: str = ".bundle") -> str:
+        return os.path.join(self.cache_dir, key + ext)
+
+    def _persist(self, key: str, bundle: DataBundle) -> bool:
+        """
+        Bundle-Datei schreiben, nur wenn sie noch die zuletzt gelesene/geschriebene Version hat
+        (Compare-and-Swap im Katalog). False = ein anderer Worker hat sie inzwischen neu geschrieben;
+        dann bleibt seine Datei stehen und unsere Kopie gilt als veraltet (_stale -> Neuladen).
+        """
+        state = bundle.build_state()
+        path = self._cache_path(key)
+        with self._lock:
+            expected = self._versions.get(key, 0)
+        tmp = _write_bundle_tmp(bundle, path)
+        try:
+            version = self.catalog.swap_bundle(key, expected, lambda: os.replace(tmp, path))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        if version is None:
+            return False
+        with self._lock:
+            if key not in self._refs:  # inzwischen freigegeben
+                os.remove(path)
+                return False
+            self._spilled[key] = path
+            self._persisted[key] = state
+            self._versions[key] = version
+        return True
+
+
+def _env_bytes(name: str) -> Optional[int]:
+    val = os.environ.get(name, "").strip()
+    return int(float(val) * 1024 * 1024) if val else None
 
-STORE = InMemoryStore()
+# Budget in MB über TABLES_STORE_MAX_MB, Auslagerungsordner über TABLES_STORE_SPILL_DIR,
+# persistenter Cache (überlebt Neustarts) über TABLES_STORE_CACHE_DIR
+STORE = InMemoryStore(
+    max_bytes=_env_bytes("TABLES_STORE_MAX_MB"),
+    spill_dir=os.environ.get("TABLES_STORE_SPILL_DIR") or None,
+    cache_dir=os.environ.get("TABLES_STORE_CACHE_DIR") or None,
+)
@@ -1,7 +1,9 @@
 # services/trees.py
-import math, re
+import re
 import pandas as pd
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Tuple, Any, Callable
+
+from .metrics import timed, count
 
 # -------- Helpers (aus deinem alten Code nachempfunden) --------
 def extract_number_and_label(label: str) -> Tuple[str|None, str]:
@@ -16,80 +18,11 @@ def _is_truthy(v) -> bool:
     s = str(v).strip().lower()
     return s not in ("", "nan")
 
-# -------- Baum ohne anytree, direkt als Dict --------
-def build_tree_for_model(df: pd.DataFrame, model_col: str) -> Dict[str, Any]:
-    """
-    Erzeugt einen Baum wie dein tree_to_dict(): {name, children:[...]}
-    - Nummer aus Label wird als Hierarchie genutzt (fallback: ID an last_number anhängen)
-    - Wenn ein Modellwert existiert, wird ein Leaf-Kind mit name="- <wert>" hinzugefügt
-    """
-    root = {"name": "Root", "children": []}
-    nodes: Dict[str, Dict[str, Any]] = {"": root}  # key = number path, "" = Root
-    last_number: str | None = None
-
-    def ensure_node(num: str, title: str):
-        if num in nodes:  # Titel ggf. einmalig setzen
-            return nodes[num]
-        parts = num.split(".")
-        parent_key = ".".join(parts[:-1])
-        parent = nodes.get(parent_key, root)
-        node = {"name": title, "children": []}
-        parent["children"].append(node)
-        nodes[num] = node
-        return node
-
-    for _, row in df.iterrows():
-        label = row.get("Label", "")
-        model_val = row.get(model_col, "")
-        number, name = extract_number_and_label(label)
-
-        if number:
-            last_number = number
-            full_title = f"{number} {name}".strip()
-        else:
-            if not last_number:
-                continue
-            raw_id = row.get("ID", "")
-            id_str = re.sub(r"\.0$", "", str(raw_id))
-            if id_str.lower() == "nan":
-                continue
-            number = f"{last_number}.{id_str}"
-            full_title = str(label).strip()
-
-        node = ensure_node(number, full_title)
-
-        if _is_truthy(model_val):
-            # wie früher: ein Leaf-Kind mit dem Wert als Text
-            node["children"].append({"name": f"- {str(model_val).strip()}", "children": []})
-
-    return root
-
-def _prune_inplace(node: Dict[str, Any]) -> bool:
-    """
-    Entfernt unbrauchbare Knoten:
-    - Behalte Blätter, deren name mit "-" beginnt (deine Werte)
-    - Behalte Eltern nur, wenn nach dem Pruning noch Kinder existieren
-    Rückgabe: True = Knoten behalten, False = entfernen
-    """
-    keep_children = []
-    for ch in node.get("children", []):
-        if _prune_inplace(ch):
-            keep_children.append(ch)
-    node["children"] = keep_children
-
-    if not node["children"] and not str(node.get("name","")).startswith("-"):
-        # Leerer, „normaler“ Knoten -> weg
-        return False
-    return True
-
-def prune_tree(tree: Dict[str, Any]) -> Dict[str, Any]:
-    # Root nie löschen, aber Kinder prunen
-    _prune_inplace(tree)
-    return tree
-
-# -------- Paths + Normalisierung (für Stripe-Suche) --------
+# -------- Normalisierung (für Suche und Index) --------
 import unicodedata
 def _strip_accents(text: str) -> str:
+    if not text or text.isascii():
+        return text or ""  # nichts zu zerlegen
     nfkd = unicodedata.normalize("NFKD", text or "")
     return "".join(c for c in nfkd if not unicodedata.combining(c))
 
@@ -104,73 +37,309 @@ def normalize(s: str) -> str:
 def to_words(q: str) -> List[str]:
     return [w for w in normalize(q).split(" ") if w]
 
-def collect_paths(tree: Dict[str, Any]) -> Tuple[List[List[str]], List[List[str]]]:
-    """ paths = Originalnamen, npaths = normalisiert """
-    paths: List[List[str]] = []
-    def walk(node, acc):
-        name = str(node.get("name","")).strip()
-        parts = acc + [name] if name else acc
-        paths.append(parts)
-        for ch in (node.get("children") or []):
-            walk(ch, parts)
-    walk(tree, [])
-    npaths = [[normalize(p) for p in parts] for parts in paths]
-    return paths, npaths
-
-# -------- Stripe- & Phrase-Suche (wie in deinem Flask-Code) --------
-from itertools import combinations
-
-def stripe_matches_for_model(paths, npaths, q_words: List[str]):
-    n = len(q_words)
-    if n < 2: return []
-    seen = set(); hits = []
-
-    for groups in range(2, n + 1):
-        for split_tuple in combinations(range(1, n), groups - 1):
-            idxs = (0,) + split_tuple + (n,)
-            phrases = [" ".join(q_words[a:b]) for a,b in zip(idxs[:-1], idxs[1:])]
-
-            for parts, nparts in zip(paths, npaths):
-                if len(nparts) < groups: continue
-                for i in range(0, len(nparts) - groups + 1):
-                    ok = True
-                    for g in range(groups):
-                        if phrases[g] not in nparts[i + g]:
-                            ok = False; break
-                    if not ok: continue
-                    anchor = tuple(parts[: i + groups])
-                    if anchor in seen: continue
-                    seen.add(anchor)
-                    hits.append({"anchor_parts": list(anchor), "path_label": " > ".join(anchor)})
-    # Sort
-    hits.sort(key=lambda x: (len(x["anchor_parts"]), x["path_label"]))
-    return hits
-
-def phrase_matches_for_model(paths, npaths, phrase: str):
-    seen = set(); out = []
-    for parts, nparts in zip(paths, npaths):
-        j = next((idx for idx, seg in enumerate(nparts) if phrase in seg), None)
-        if j is None: continue
-        anchor = tuple(parts[: j+1])
-        if anchor in seen: continue
-        seen.add(anchor)
-        out.append({"anchor_parts": list(anchor), "path_label": " > ".join(anchor)})
-    out.sort(key=lambda x: (len(x["anchor_parts"]), x["path_label"]))
+from collections import deque
+import heapq
+
+# -------- Single-Pass-Builder (Hierarchie einmal, Modelle nur als Spalten) --------
+import numpy as np
+from dataclasses import dataclass
+from .search import SegmentPool, build_node_index
+
+_NUM_RX = r"^(\d+(?:\.\d+)*)(.*)$"
+
+@dataclass
+class RowHierarchy:
+    """
+    Modellunabhängige Hierarchie aus der Label-Nummerierung.
+    Knoten 0..n-1 in Erzeugungsreihenfolge (Elternknoten vor ihren Kindern).
+    """
+    keys: List[str]          # Nummernpfad je Knoten, z.B. "3.3.1"
+    titles: List[str]        # Anzeigename je Knoten
+    parent: np.ndarray       # Elternknoten-Index, -1 = Root
+    first_row: np.ndarray    # Zeile, in der der Knoten erzeugt wurde
+    row_node: np.ndarray     # Knoten je DF-Zeile, -1 = Zeile wird übersprungen
+    dash_nodes: List[int]    # Knoten, deren Titel mit "-" beginnt (überleben Pruning immer)
+
+@timed("tree.hierarchy")
+def parse_hierarchy(df: pd.DataFrame) -> RowHierarchy:
+    """
+    Parst die Nummerierung EINMAL für alle Zeilen (vektorisiert über die Label-Spalte).
+    Nummerierte Zeilen -> eigener Knoten, unnummerierte Zeilen -> '<letzte Nummer>.<ID>',
+    vorher/ohne ID -> übersprungen.
+    """
+    n = len(df)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return RowHierarchy([], [], empty, empty, empty, [])
+
+    labels = (df["Label"] if "Label" in df.columns else pd.Series([""] * n, index=df.index))
+    labels = labels.map(str).str.strip()
+    ext = labels.str.extract(_NUM_RX)
+    num = ext[0]
+    has_num = num.notna().to_numpy()
+    name = ext[1].fillna("").str.strip()
+
+    raw_ids = df["ID"] if "ID" in df.columns else pd.Series([""] * n, index=df.index)
+    id_str = raw_ids.map(str).str.replace(r"\.0$", "", regex=True)
+    last_number = num.ffill()
+
+    unnum_ok = (~has_num) & last_number.notna().to_numpy() & (id_str.str.lower() != "nan").to_numpy()
+    valid = has_num | unnum_ok
+
+    keys = np.where(has_num, num.fillna("").to_numpy(dtype=object),
+                    (last_number.fillna("") + "." + id_str).to_numpy(dtype=object))
+    titles = np.where(has_num, (num.fillna("") + " " + name).str.strip().to_numpy(dtype=object),
+                      labels.to_numpy(dtype=object))
+
+    row_node = np.full(n, -1, dtype=np.int64)
+    valid_rows = np.flatnonzero(valid)
+    codes, uniques = pd.factorize(pd.Series(keys[valid_rows], dtype=object), sort=False)
+    row_node[valid_rows] = codes
+    # factorize nummeriert in Reihenfolge des ersten Auftretens -> Erzeugungsreihenfolge
+    _, first_pos = np.unique(codes, return_index=True)
+    first_row = valid_rows[first_pos]
+
+    node_keys = [str(k) for k in uniques]
+    pos = {k: i for i, k in enumerate(node_keys)}
+    parent = np.full(len(node_keys), -1, dtype=np.int64)
+    for i, k in enumerate(node_keys):
+        p = pos.get(k.rpartition(".")[0], -1)
+        # Eltern zählen nur, wenn sie VORHER erzeugt wurden (sonst hängt der Knoten an Root)
+        if 0 <= p < i:
+            parent[i] = p
+
+    node_titles = [str(t) for t in titles[first_row]]
+    return RowHierarchy(
+        keys=node_keys,
+        titles=node_titles,
+        parent=parent,
+        first_row=first_row,
+        row_node=row_node,
+        dash_nodes=[i for i, t in enumerate(node_titles) if t.startswith("-")],
+    )
+
+def truthy_mask(col: pd.Series) -> np.ndarray:
+    """ Vektorisierte Variante von _is_truthy für eine ganze Spalte. """
+    kind = col.dtype.kind if isinstance(col.dtype, np.dtype) else "O"
+    if kind == "f":
+        return ~np.isnan(col.to_numpy(dtype=float))
+    if kind in "iub":
+        return np.ones(len(col), dtype=bool)
+    # _is_truthy nur einmal je distinktem Wert; fehlende Werte (NaN/None) sind leer
+    codes, uniques = pd.factorize(col)
+    uniq_ok = np.fromiter((_is_truthy(v) for v in uniques), dtype=bool, count=len(uniques))
+    return np.append(uniq_ok, False)[codes]
+
+@timed("tree.build")
+def build_pruned_tree(hier: RowHierarchy, col: pd.Series) -> Dict[str, Any]:
+    """
+    Baut den geprunten Baum eines Modells direkt aus der Hierarchie + Spaltenarray.
+    Werte werden Blätter "- <Wert>", Knoten ohne Wert im Teilbaum fallen weg (Root bleibt);
+    Kosten ~ behaltene Knoten + Werte.
+    """
+    root = {"name": "Root", "children": []}
+    n_nodes = len(hier.keys)
+    if n_nodes == 0:
+        return root
+
+    leaf_rows = np.flatnonzero(truthy_mask(col) & (hier.row_node >= 0))
+    leaf_nodes = hier.row_node[leaf_rows]
+
+    # Behalten: Knoten mit Wert oder mit "-"-Titel, plus alle Vorfahren
+    keep = np.zeros(n_nodes, dtype=bool)
+    seeds = set(leaf_nodes.tolist())
+    seeds.update(hier.dash_nodes)
+    parent = hier.parent
+    for i in seeds:
+        while i >= 0 and not keep[i]:
+            keep[i] = True
+            i = parent[i]
+
+    # Ereignisse in Zeilenreihenfolge: Knoten-Erzeugung vor Leaf derselben Zeile
+    kept_nodes = np.flatnonzero(keep)
+    ev_row = np.concatenate([hier.first_row[kept_nodes], leaf_rows])
+    ev_kind = np.concatenate([np.zeros(len(kept_nodes), dtype=np.int8), np.ones(len(leaf_rows), dtype=np.int8)])
+    ev_node = np.concatenate([kept_nodes, leaf_nodes])
+    order = np.lexsort((ev_kind, ev_row))
+
+    count("nodes_built", len(kept_nodes) + len(leaf_rows))
+    values = col.to_numpy(dtype=object)
+    titles = hier.titles
+    nodes: Dict[int, Dict[str, Any]] = {}
+    for r, k, i in zip(ev_row[order].tolist(), ev_kind[order].tolist(), ev_node[order].tolist()):
+        if k == 0:
+            node = {"name": titles[i], "children": []}
+            p = parent[i]
+            (nodes[p] if p >= 0 else root)["children"].append(node)
+            nodes[i] = node
+        else:
+            nodes[i]["children"].append({"name": f"- {str(values[r]).strip()}", "children": []})
+    return root
+
+@timed("tree.index")
+def build_model_index(tree: Dict[str, Any], pool: SegmentPool) -> Dict[str, Any]:
+    """
+    Suchindex eines Modells: {"nodes": {...}} = Knotentabelle (search.build_node_index).
+    nodes["refs"] löst Anker (z.B. anchor_parts aus /search) direkt in Baumknoten auf.
+    """
+    return {"nodes": build_node_index(tree, pool, normalize)}
+
+def count_nodes(tree: Dict[str, Any]) -> int:
+    n, stack = 0, [tree]
+    while stack:
+        node = stack.pop()
+        n += 1
+        stack.extend(node.get("children") or [])
+    return n
+
+def slice_tree(node: Dict[str, Any], max_depth: int | None = None, max_nodes: int | None = None) -> Dict[str, Any]:
+    """
+    Kopie eines (Teil-)Baums, begrenzt auf max_depth Ebenen unter `node` und max_nodes Knoten
+    (breitenweise, obere Ebenen zuerst). Gekappte Knoten bekommen "more" = Anzahl ausgelassener Kinder.
+    """
+    out = {"name": node.get("name", ""), "children": []}
+    queue = deque([(node, out, 0)])
+    kept = 1
+    while queue:
+        src, dst, d = queue.popleft()
+        kids = src.get("children") or []
+        if not kids:
+            continue
+        if max_depth is not None and d >= max_depth:
+            dst["more"] = len(kids)
+            continue
+        for i, ch in enumerate(kids):
+            if max_nodes is not None and kept >= max_nodes:
+                dst["more"] = len(kids) - i
+                break
+            c = {"name": ch.get("name", ""), "children": []}
+            dst["children"].append(c)
+            kept += 1
+            queue.append((ch, c, d + 1))
     return out
 
-def build_all_model_trees(df: pd.DataFrame) -> Tuple[Dict[str,Any], Dict[str,Any]]:
+def select_lod_nodes(parent: List[int], values: List[float], max_nodes: int) -> Tuple[List[int], Dict[int, List[int]]]:
+    """
+    Level-of-Detail für Treemaps: wählt Knoten größte-zuerst (Wert), solange behaltene Knoten plus je ein
+    Sammelknoten pro teilweise aufgeklapptem Elternknoten in max_nodes passen.
+    parent[i] = Elternknoten (-1 = Wurzel). Rückgabe: (behaltene Knoten aufsteigend,
+    {Elternknoten: zusammengefasste Kinder}); behaltene Knoten ohne behaltene Kinder bleiben zugeklappt.
+    """
+    par = np.asarray(parent, dtype=np.int64)
+    # Kinder als CSR: by_parent[start[p]:start[p + 1]] (Wurzeln zuerst, dann je Elternknoten in Reihenfolge)
+    by_parent = np.argsort(par, kind="stable")
+    n_kids = np.bincount(par[par >= 0], minlength=len(par))
+    start = (np.concatenate(([0], np.cumsum(n_kids))) + int((par < 0).sum())).tolist()
+    by_parent = by_parent.tolist()
+    n_kids = n_kids.tolist()
+
+    def kids(p: int) -> List[int]:
+        return by_parent[start[p]:start[p + 1]]
+
+    heap = [(-values[i], i) for i in by_parent[:start[0]]]
+    heapq.heapify(heap)
+    left = list(n_kids)                          # noch nicht behaltene Kinder
+    kept: List[int] = []
+    cost = 0
+    while heap:
+        i = heap[0][1]
+        p = parent[i]
+        if p < 0:
+            delta = 1
+        elif left[p] == n_kids[p]:               # erstes Kind: Rest braucht einen Sammelknoten
+            delta = 1 + (left[p] > 1)
+        else:                                    # letztes Kind ersetzt den Sammelknoten
+            delta = 1 - (left[p] == 1)
+        if cost + delta > max_nodes:
+            break
+        heapq.heappop(heap)
+        cost += delta
+        kept.append(i)
+        if p >= 0:
+            left[p] -= 1
+        for c in kids(i):
+            heapq.heappush(heap, (-values[c], c))
+
+    shown = set(kept)
+    merged: Dict[int, List[int]] = {}
+    for p in kept:
+        if 0 < left[p] < n_kids[p]:
+            rest = [c for c in kids(p) if c not in shown]
+            if len(rest) == 1:                   # ein einzelnes Kind statt "other (1 items)"
+                shown.add(rest[0])
+            else:
+                merged[p] = rest
+    return sorted(shown), merged
+
+def lod_label(n: int) -> str:
+    return f"other ({n} items)"
+
+def lod_tree(node: Dict[str, Any], max_nodes: int) -> Dict[str, Any]:
+    """
+    Kopie eines (Teil-)Baums mit max. max_nodes Knoten: die kleinsten Geschwister (nach Blattanzahl, wie die
+    Treemap sie zeichnet) werden zu {"name": "other (n items)", "other": n, "size": Blätter} zusammengefasst;
+    zugeklappte Knoten tragen "more" (ausgelassene Kinder) und "size".
+    """
+    flat: List[Dict[str, Any]] = []
+    parent: List[int] = []
+    stack = [(node, -1)]
+    while stack:
+        src, p = stack.pop()
+        parent.append(p)
+        flat.append(src)
+        me = len(flat) - 1
+        stack.extend((ch, me) for ch in reversed(src.get("children") or []))
+    if len(flat) <= max_nodes:
+        return slice_tree(node)
+    size = [0.0] * len(flat)
+    for i in range(len(flat) - 1, -1, -1):       # Kinder liegen hinter ihren Eltern
+        size[i] = max(size[i], 1.0)
+        if parent[i] >= 0:
+            size[parent[i]] += size[i]
+
+    keep, merged = select_lod_nodes(parent, size, max_nodes)
+    out: Dict[int, Dict[str, Any]] = {}
+    for i in keep:
+        c = {"name": flat[i].get("name", ""), "children": []}
+        out[i] = c
+        if parent[i] >= 0:
+            out[parent[i]]["children"].append(c)
+    for i in keep:
+        kids = flat[i].get("children") or []
+        if kids and not out[i]["children"]:     # zugeklappt
+            out[i]["more"] = len(kids)
+            out[i]["size"] = int(size[i])
+    for p, rest in merged.items():
+        out[p]["children"].append({"name": lod_label(len(rest)), "children": [], "other": len(rest),
+                                   "size": int(sum(size[c] for c in rest))})
+    return out[0]
+
+def build_all_model_trees(
+    df: pd.DataFrame,
+    progress: Callable[[str, int, int, str], None] | None = None,
+    hier: RowHierarchy | None = None,
+    pool: SegmentPool | None = None,
+) -> Tuple[Dict[str,Any], Dict[str,Any]]:
     """
     Erzeugt:
       trees[model] = pruned tree (dict)
-      index[model] = {"paths": [...], "npaths": [...]}
+      index[model] = {"nodes": {...}}
+    Die Hierarchie wird einmal geparst; pro Modell wird nur noch die Spalte angehängt.
+    Alle Modelle teilen sich einen SegmentPool (Substring-Suche über eindeutige Segmente).
+    progress(stage, done, total, model) wird nach jedem Baum ("build") und Index ("index") gerufen.
     """
     model_cols = [c for c in df.columns if c not in ("ID","Label")]
     trees: Dict[str,Any] = {}
     index: Dict[str,Any] = {}
-    for m in model_cols:
-        t = build_tree_for_model(df, m)
-        t = prune_tree(t)
-        paths, npaths = collect_paths(t)
+    hier = hier if hier is not None else parse_hierarchy(df)
+    pool = pool if pool is not None else SegmentPool()
+    total = len(model_cols)
+    for i, m in enumerate(model_cols, 1):
+        t = build_pruned_tree(hier, df[m])
         trees[m] = t
-        index[m] = {"paths": paths, "npaths": npaths}
+        if progress:
+            progress("build", i, total, m)
+        index[m] = build_model_index(t, pool)
+        if progress:
+            progress("index", i, total, m)
     return trees, index
@@ -0,0 +1,169 @@
+# services/update.py
+"""
+Inkrementelle Änderungen an einem bestehenden Dataset (PATCH /dataset/{id}):
+- Modellspalten hinzufügen/ersetzen (Werte je ID)
+- Zeilen per ID upserten (Label und/oder Modellwerte; unbekannte IDs werden angehängt)
+Baum, Suchindex und Blob verlieren nur die betroffenen Modelle. Hierarchie und Roll-ups
+werden nur bei Strukturänderungen (neue Zeilen, geänderte Labels) neu aufgebaut,
+sonst werden nur die geänderten Roll-up-Spalten neu gerechnet.
+"""
+from typing import Dict, List, Any, Optional, Set
+
+import pandas as pd
+
+from .tree import parse_hierarchy, build_pruned_tree
+from .builder import build_rollup, update_rollup_columns
+
+def _same(a, b) -> bool:
+    try:
+        if pd.isna(a) and pd.isna(b):
+            return True
+    except (TypeError, ValueError):
+        pass
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        return False
+
+def _set_cells(df: pd.DataFrame, rows: List[int], col: str, value) -> None:
+    idx = df.index[rows]
+    try:
+        df.loc[idx, col] = value
+    except (TypeError, ValueError):
+        # z.B. Text in eine float-Spalte -> Spalte auf object erweitern
+        df[col] = df[col].astype(object)
+        df.loc[idx, col] = value
+
+def apply_patch(bundle, columns: Optional[Dict[str, Dict[str, Any]]] = None,
+                rows: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Wendet die Änderungen auf `bundle` (store.DataBundle) an; Tabelle, meta, Hierarchie und Roll-ups
+    werden neu aufgebaut und gemeinsam unter bundle._lock getauscht.
+    columns = {Modell: {ID: Wert}} -> Spalte neu bzw. ersetzt (IDs ohne Eintrag = leer)
+    rows    = [{"ID": ..., "Label": ..., <Modell>: Wert, ...}] -> vorhandene IDs aktualisieren, neue anhängen
+    Rückgabe: {"models", "rebuilt", "rows_added", "rows_updated"}. Ungültige Änderungen -> ValueError
+    (dann bleibt das Bundle unverändert).
+    """
+    columns = columns or {}
+    rows = rows or []
+    meta = bundle.meta
+    df = bundle.frames["main"]
+
+    # ---- prüfen (noch nichts verändern) ----
+    for name in columns:
+        if str(name).strip() in ("", "ID", "Label"):
+            raise ValueError(f"Ungültiger Modellname '{name}'.")
+    known_ids = meta["label_map"]
+    for name, values in columns.items():
+        unknown = [str(k).strip() for k in values if str(k).strip() not in known_ids]
+        if unknown:
+            raise ValueError(f"Spalte '{name}': unbekannte IDs {unknown[:5]}.")
+    allowed_cols = set(df.columns) | set(columns)
+    for r in rows:
+        rid = str(r.get("ID", "")).strip()
+        if not rid:
+            raise ValueError("Zeile ohne ID.")
+        extra = [k for k in r if k not in allowed_cols]
+        if extra:
+            raise ValueError(f"Zeile '{rid}': unbekannte Spalten {extra} (neue Modelle über 'columns' anlegen).")
+        if rid not in known_ids and not str(r.get("Label", "")).strip():
+            raise ValueError(f"Neue Zeile '{rid}' braucht ein Label.")
+
+    # ---- neue Tabelle ----
+    new = df.copy()
+    row_ids = new["ID"].to_numpy(dtype=object)
+    changed: Set[str] = set()
+    structure = False
+
+    for name, values in columns.items():
+        vals = {str(k).strip(): v for k, v in values.items()}
+        new[name] = pd.Series(row_ids, index=new.index).map(vals)
+        changed.add(name)
+
+    rows_of: Dict[str, List[int]] = {}
+    for i, x in enumerate(row_ids):
+        rows_of.setdefault(x, []).append(i)
+    appended: Dict[str, Dict[str, Any]] = {}
+    updated = 0
+    for r in rows:
+        rid = str(r["ID"]).strip()
+        fields = {k: (str(v).strip() if k == "Label" else v) for k, v in r.items() if k != "ID"}
+        if rid in appended:
+            appended[rid].update(fields)
+            continue
+        if rid not in rows_of:
+            appended[rid] = {"ID": rid, **fields}
+            continue
+        hit = rows_of[rid]
+        touched = False
+        for k, v in fields.items():
+            if all(_same(new.iat[i, new.columns.get_loc(k)], v) for i in hit):
+                continue
+            _set_cells(new, hit, k, v)
+            touched = True
+            if k == "Label":
+                structure = True
+            else:
+                changed.add(k)
+        updated += touched
+
+    if appended:
+        new = pd.concat([new, pd.DataFrame(list(appended.values()))], ignore_index=True)
+        structure = True
+        # neue Zeilen ohne Wert in einer Modellspalte bleiben leer (NaN)
+
+    # ---- neue meta (Kopien; Leser sehen bis zum Tausch die alte) ----
+    model_cols = meta["model_cols"] + [name for name in columns if name not in meta["model_cols"]]
+    label_map, parent_map, children_map = dict(meta["label_map"]), dict(meta["parent_map"]), dict(meta["children_map"])
+    for r in rows:
+        rid = str(r["ID"]).strip()
+        if "Label" in r:
+            label_map[rid] = str(r["Label"]).strip()
+        if rid not in parent_map:
+            parent = rid.rsplit(".", 1)[0] if "." in rid else ""
+            parent_map[rid] = parent
+            children_map[parent] = children_map.get(parent, []) + [rid]
+    new_meta = {**meta, "model_cols": model_cols, "label_map": label_map,
+                "parent_map": parent_map, "children_map": children_map}
+
+    # ---- Hierarchie / Roll-ups ----
+    models = list(model_cols)
+    with bundle._lock:
+        if structure:
+            hier = parse_hierarchy(new)
+            rollup = build_rollup(new, new_meta) if bundle.rollup is not None else None
+            candidates = set(models)
+        else:
+            hier = bundle.hier
+            rollup = bundle.rollup
+            if rollup is not None and changed:
+                rollup = update_rollup_columns(rollup, new, [m for m in models if m in changed])
+            candidates = changed
+
+        # Nur schon gebaute Bäume prüfen; ist der neue Baum gleich, bleiben Index + Blob erhalten
+        rebuilt = []
+        for m in models:
+            if m not in candidates:
+                continue
+            old = bundle.trees.get(m)
+            if old is not None:
+                tree = build_pruned_tree(hier, new[m])
+                if tree == old:
+                    continue
+                bundle.trees[m] = tree
+            for cache in (bundle.index, bundle.blobs, bundle.node_counts):
+                cache.pop(m, None)
+            rebuilt.append(m)
+
+        bundle.frames["main"] = new
+        bundle.meta = new_meta
+        bundle.hier = hier
+        if rollup is not bundle.rollup:
+            bundle.rollup = rollup
+            bundle.coverage = None
+            bundle.compare_cache.clear()
+        if rebuilt:
+            bundle.prefix_index = None
+            bundle.suggest_cache.clear()
+
+    return {"models": models, "rebuilt": rebuilt, "rows_added": len(appended), "rows_updated": updated}
@@ -0,0 +1,76 @@
+# services/upload.py
+"""
+Uploads blockweise in eine Datei im Upload-Ordner kopieren (Digest + Größenlimit unterwegs),
+statt die ganze Datei als bytes im Speicher zu halten. Der Ingestion-Worker liest dann
+über den Pfad (read_csv/openpyxl streamen selbst); die Datei gehört ab IngestJobs.submit dem Job.
+"""
+from typing import Any, BinaryIO, Optional, Tuple
+import hashlib
+import os
+import tempfile
+
+from fastapi.concurrency import run_in_threadpool
+
+from .loader import raw_digest
+
+CHUNK_BYTES = 1024 * 1024
+
+class UploadTooLarge(Exception):
+    pass
+
+def _env_bytes(name: str, default_mb: Optional[float]) -> Optional[int]:
+    val = os.environ.get(name, "").strip()
+    mb = float(val) if val else default_mb
+    return int(mb * 1024 * 1024) if mb else None
+
+# Max. Uploadgröße in MB über TABLES_UPLOAD_MAX_MB (0 = unbegrenzt), Ordner über TABLES_UPLOAD_DIR
+MAX_UPLOAD_BYTES = _env_bytes("TABLES_UPLOAD_MAX_MB", 512)
+UPLOAD_DIR = os.environ.get("TABLES_UPLOAD_DIR") or None
+
+def too_large(content_length: Optional[str], max_bytes: Optional[int] = MAX_UPLOAD_BYTES) -> bool:
+    """ Vorab-Prüfung über den Content-Length-Header (Multipart-Overhead ist vernachlässigbar). """
+    if max_bytes is None or not content_length:
+        return False
+    try:
+        return int(content_length) > max_bytes + 64 * 1024
+    except ValueError:
+        return False
+
+def limit_message(max_bytes: Optional[int] = MAX_UPLOAD_BYTES) -> str:
+    return f"Datei zu groß (max {max_bytes / (1024 * 1024):g} MB)."
+
+async def spool_upload(file: Any, filename: str, max_bytes: Optional[int] = MAX_UPLOAD_BYTES,
+                       upload_dir: Optional[str] = UPLOAD_DIR) -> Tuple[str, str]:
+    """
+    Kopiert `file` (async read(n), z.B. UploadFile) in Blöcken nach upload_dir -> (Pfad, Rohbyte-Digest).
+    Über max_bytes: Datei wird gelöscht, UploadTooLarge.
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    # Dateizugriffe und Hashing blockieren -> im Threadpool, der Event-Loop bleibt frei
+    out, path = await run_in_threadpool(_open_spool, ext, upload_dir)
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with out:
+            while True:
+                chunk = await file.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLarge(limit_message(max_bytes))
+                await run_in_threadpool(_write_chunk, out, h, chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, raw_digest(h)
+
+def _open_spool(ext: str, upload_dir: Optional[str]) -> Tuple[BinaryIO, str]:
+    if upload_dir:
+        os.makedirs(upload_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=ext, dir=upload_dir)
+    return os.fdopen(fd, "wb"), path
+
+def _write_chunk(out: BinaryIO, h: Any, chunk: bytes) -> None:
+    h.update(chunk)
+    out.write(chunk)
@@ -5,6 +5,10 @@ const statusEl = $('#status');
 const modelSel = $('#model');
 const resultsDD = $('#resultsDropdown');
 
+// Obergrenze an Knoten pro Treemap (lod=1: Server wählt die Knoten nach Detailgrad, zugeklappte
+// Teilbäume bleiben als ein Knoten stehen, node.size trägt deren Blattanzahl)
+const MAX_NODES = 5000;
+
 function norm(s){ return (s||"").toString().trim().toLowerCase().replace(/\s+/g,' '); }
 
 $('#btnUpload').onclick = async () => {
@@ -15,7 +19,11 @@ $('#btnUpload').onclick = async () => {
   statusEl.textContent = '⏳ Upload...';
   const res = await fetch('/upload', { method: 'POST', body: fd });
   if (!res.ok) { statusEl.textContent = '❌ Upload error'; alert(await res.text()); return; }
-  const data = await res.json();
+  const up = await res.json();
+
+  // Ingestion läuft als Job -> Status pollen bis dataset_id da ist
+  const data = await waitForJob(up.job_id);
+  if (!data) return;
   dataset_id = data.dataset_id;
 
   // Modell-Dropdown: zuerst "nothing"
@@ -31,19 +39,29 @@ $('#btnUpload').onclick = async () => {
   statusEl.textContent = `✅ file Uploaded`;
 };
 
-function filterByPath(tree, parts) {
-  if (!parts || parts.length < 2) return tree;
-  const n = s => (s||"").toString().trim().toLowerCase().replace(/\s+/g,' ');
-  let node = tree;
-  for (let i=1; i<parts.length; i++){
-    const target = n(parts[i]);
-    if (!node.children) return tree;
-    let next = node.children.find(c => n(c.name) === target);
-    if (!next) next = node.children.find(c => n(c.name).startsWith(target));
-    if (!next) return tree;
-    node = next;
+function jobStageText(job) {
+  const st = job.stage && job.stages[job.stage];
+  if (!st) return job.status;
+  const m = st.model ? ` (${st.model})` : '';
+  return `${job.stage} ${st.done}/${st.total}${m}`;
+}
+
+async function waitForJob(job_id) {
+  while (true) {
+    const res = await fetch(`/jobs/${encodeURIComponent(job_id)}`);
+    if (!res.ok) { statusEl.textContent = '❌ Upload error'; alert(await res.text()); return null; }
+    const job = await res.json();
+    if (job.status === 'done') return job;
+    if (job.status === 'error') { statusEl.textContent = '❌ Upload error'; alert(job.error); return null; }
+    statusEl.textContent = `⏳ ${jobStageText(job)}`;
+    await new Promise(r => setTimeout(r, 500));
   }
-  return JSON.parse(JSON.stringify(node));
+}
+
+function treeUrl(model, anchorParts) {
+  const p = new URLSearchParams({ dataset_id, model, max_nodes: MAX_NODES, lod: 1 });
+  (anchorParts || []).forEach(a => p.append('anchor', a));
+  return `/tree?${p.toString()}`;
 }
 
 function drawSingleTreemap(tree, title, targetEl, highlightTerm='') {
@@ -62,10 +80,11 @@ function drawSingleTreemap(tree, title, targetEl, highlightTerm='') {
       node.children.forEach(ch => { sum += build(ch, myId); });
       size = Math.max(sum, 1);
     } else {
-      size = 1;
+      size = node.size || 1;  // Sammel-/zugeklappte Knoten (lod): Blattanzahl vom Server
     }
 
     let display = name;
+    if (node.more) display = `${name} (+${node.more})`;
     if (isHit) {
       const idx = lname.indexOf(q);
       display = name.slice(0, idx) + '<b>' + name.slice(idx, idx+q.length) + '</b>' + name.slice(idx+q.length);
@@ -100,7 +119,7 @@ function drawSingleTreemap(tree, title, targetEl, highlightTerm='') {
 $('#btnDraw').onclick = async () => {
   const model = modelSel.value;
   if (!dataset_id || !model) return alert('please upload a dataset or choose a model first');
-  const res = await fetch(`/tree?dataset_id=${encodeURIComponent(dataset_id)}&model=${encodeURIComponent(model)}`);
+  const res = await fetch(treeUrl(model, null));
   if (!res.ok) { alert(await res.text()); return; }
   const tree = await res.json();
 
@@ -144,13 +163,10 @@ resultsDD.onchange = async (e) => {
   if (!val) return;
   const h = JSON.parse(val);
 
-  // Baum für das Treffer-Modell laden
-  const res2 = await fetch(`/tree?dataset_id=${encodeURIComponent(dataset_id)}&model=${encodeURIComponent(h.model)}`);
+  // Nur den Teilbaum am Treffer laden (Server löst den Anker auf)
+  const res2 = await fetch(treeUrl(h.model, h.anchor_parts));
   if (!res2.ok) { alert(await res2.text()); return; }
-  const tree = await res2.json();
-
-  // Subtree holen
-  const sub = filterByPath(tree, h.anchor_parts) || tree;
+  const sub = await res2.json();
 
   // Pfad-Skelett bauen (Eltern ohne Geschwister, am Treffer alle Kinder)
   const skeleton = { name: h.anchor_parts[0], children: [] };